@@ -4,22 +4,68 @@ import json
 import zipfile
 import csv
 import shutil
+import bisect
+import sqlite3
+import argparse
+import hashlib
+import heapq
+import math
+import mmap
+import struct
+import multiprocessing
+import threading
+import shlex
+import time
+import gc
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from itertools import compress
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton, QFileDialog,
     QVBoxLayout, QLineEdit, QHBoxLayout, QMessageBox, QListWidget, QListWidgetItem,
     QListView, QComboBox, QGroupBox, QTextEdit, QSplitter,
     QDialog, QTextBrowser, QToolTip, QFormLayout, QGridLayout,
-    QTableWidget, QTableWidgetItem, QHeaderView
+    QTableWidget, QTableWidgetItem, QHeaderView, QStyledItemDelegate, QStyle, QSpinBox, QCheckBox,
+    QTabWidget
+)
+from PyQt5.QtGui import QPixmap, QIcon, QDrag, QFont, QImage, QColor, QFontMetrics
+from PyQt5.QtCore import (
+    QSize, Qt, QMimeData, QRegularExpression, QTimer, QPoint, QRect, QAbstractListModel, QModelIndex,
+    QSortFilterProxyModel
 )
-from PyQt5.QtGui import QPixmap, QIcon, QDrag, QFont
-from PyQt5.QtCore import QSize, Qt, QMimeData, QRegularExpression, QTimer, QPoint
 
 DATA_DIR = "data"
 IMG_DIR = os.path.join(DATA_DIR, "portraits")
 CHAR_FILE = os.path.join(DATA_DIR, "characters.json")
+CHAR_ORDER_FILE = os.path.join(DATA_DIR, "character_order.json")
 MATCH_FILE = os.path.join(DATA_DIR, "matches.json")
+MATCH_JOURNAL_FILE = os.path.join(DATA_DIR, "matches.journal.jsonl")
+SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+DB_FILE = os.path.join(DATA_DIR, "nikke.db")
+NOTES_INDEX_FILE = os.path.join(DATA_DIR, "notes_index.json")
+MATCH_STATS_FILE = os.path.join(DATA_DIR, "match_stats.json")
+MATCH_ARCHIVE_FILE = os.path.join(DATA_DIR, "matches.nka")
+MATCH_ARCHIVE_JOURNAL_FILE = os.path.join(DATA_DIR, "matches.nka.journal.jsonl")
+THUMB_DIR = os.path.join(DATA_DIR, "thumbnails")
+THUMB_INDEX_FILE = os.path.join(THUMB_DIR, "index.json")
+RL_KEYS = ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]
+TEAM_SIZE = 5
+# 存储签名（文件 stat / data_version）的最短复查间隔，秒；绘制时每个头像都会查角色表，不能每次都 stat
+SIGNATURE_CHECK_INTERVAL = 1.0
+# 战绩归档：头部（魔数、版本、保留、条数、角色名数、10 个分段起始偏移，最后一个为文件末尾），
+# 之后依次是 角色名偏移表 u32、角色名 UTF-8、id i64、队伍槽 u16×10、结果 u8、指纹 u64×2、
+# 备注偏移表 u64、备注 UTF-8、无法按列存放的字段（JSON），全部小端
+MATCH_ARCHIVE_MAGIC = b"NKMA"
+MATCH_ARCHIVE_VERSION = 1
+MATCH_ARCHIVE_HEADER = struct.Struct("<4sHHII" + "Q" * 10)
+BURST_THRESHOLD = 100
 
 os.makedirs(IMG_DIR, exist_ok=True)
+os.makedirs(THUMB_DIR, exist_ok=True)
 if not os.path.exists(CHAR_FILE):
     with open(CHAR_FILE, "w", encoding="utf-8") as f:
         json.dump([], f, indent=2, ensure_ascii=False)
@@ -70,96 +116,2942 @@ BUTTON_STYLE = {
     """
 }
 
-def get_character_image_path(character_name):
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+@contextmanager
+def gc_paused():
+    # 一次性创建大量容器对象（不形成循环引用）时暂停循环 GC，免得反复扫描整个堆
+    enabled = gc.isenabled()
+    gc.disable()
     try:
-        with open(CHAR_FILE, "r", encoding="utf-8") as f:
-            characters = json.load(f)
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def write_json_atomic(path, data, indent=2):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_settings():
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+def backfill_match_ids(matches):
+    # 为缺少 id 或 id 重复的战绩分配新 id，返回 (是否有改动, 下一个可用 id)
+    used = {match["id"] for match in matches if isinstance(match.get("id"), int)}
+    next_id = max(used, default=0) + 1
+    changed = False
+    for match in matches:
+        if not isinstance(match.get("id"), int) or match["id"] not in used:
+            match["id"] = next_id
+            next_id += 1
+            changed = True
+        else:
+            used.discard(match["id"])
+    return changed, next_id
+
+def team_fingerprint(team):
+    # 与站位顺序无关的阵容指纹：成员小写、去重、排序后取 8 字节 blake2b，存为十六进制
+    members = sorted({name.lower() for name in team if name})
+    return hashlib.blake2b("\x1f".join(members).encode("utf-8"), digest_size=8).hexdigest()
+
+def stamp_team_fingerprints(match):
+    match["team_a_fp"] = team_fingerprint(match.get("team_a", []))
+    match["team_b_fp"] = team_fingerprint(match.get("team_b", []))
+
+def backfill_team_fingerprints(matches):
+    # 旧数据没有指纹时补上，返回是否有改动
+    changed = False
+    for match in matches:
+        if "team_a_fp" not in match or "team_b_fp" not in match:
+            stamp_team_fingerprints(match)
+            changed = True
+    return changed
+
+class JsonCharacterBackend:
+    # 拖动排序只写 order_path（紧凑的角色名列表），不重写整个角色表；整表保存时按当前顺序写入并删掉它
+    def __init__(self, path, order_path):
+        self.path = path
+        self.order_path = order_path
+
+    def signature(self):
+        return (file_signature(self.path), file_signature(self.order_path))
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                characters = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取角色数据失败: {e}")
+            return []
+        try:
+            with open(self.order_path, "r", encoding="utf-8") as f:
+                order = json.load(f)
+        except FileNotFoundError:
+            return characters
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取角色顺序失败: {e}")
+            return characters
+        return apply_character_order(characters, order)
+
+    def save(self, characters):
+        write_json_atomic(self.path, characters)
+        if os.path.exists(self.order_path):
+            os.remove(self.order_path)
+
+    def save_order(self, names):
+        write_json_atomic(self.order_path, names, indent=None)
+
+def apply_character_order(characters, order):
+    # 按位置索引排序；索引里没有的角色（如手动改过 characters.json）保持原相对顺序排在最后
+    positions = {name: pos for pos, name in enumerate(order)}
+    return sorted(characters, key=lambda char: positions.get(char["name"], len(positions)))
+
+class WriteBehind:
+    # 写回调度：schedule() 后静默 delay_ms 毫秒才调用 write，期间再次 schedule 重新计时，
+    # 连续多次修改合并成一次写；关窗或退出程序时调用 flush() 立即写入
+    def __init__(self, write, delay_ms=1500):
+        self.write = write
+        self.delay_ms = delay_ms
+        self.pending = False
+        self._timer = None
+
+    def schedule(self):
+        self.pending = True
+        if QApplication.instance() is None:
+            self.flush()
+            return
+        if self._timer is None:
+            # QTimer 要在 QApplication 创建后才能建，第一次安排写入时再建
+            self._timer = QTimer()
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self.flush)
+        self._timer.start(self.delay_ms)
+
+    def cancel(self):
+        self.pending = False
+        if self._timer is not None:
+            self._timer.stop()
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.stop()
+        if not self.pending:
+            return
+        try:
+            self.write()
+        except Exception as e:
+            # 保留待写状态，下次 flush（最迟退出时）再试
+            print(f"延迟写入失败: {e}")
+            return
+        self.pending = False
+
+class NameTrigramIndex:
+    # 角色名和昵称（小写）的三元组倒排索引。首尾补位，一两个字的名字也有三元组；
+    # 查询只累计与查询共享三元组的条目，按 Dice 系数打分，不扫描整个角色表
+    def __init__(self, entries=()):
+        self.entries = []
+        self.postings = {}
+        for key, name in entries:
+            grams = self.grams(key)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(len(self.entries))
+            self.entries.append((name, len(grams)))
+
+    @staticmethod
+    def grams(text):
+        padded = f"\x02\x02{text.lower()}\x03"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def search(self, text, limit=5, min_score=0.3):
+        # [(角色名, 得分)]，得分高的在前；同一角色的名字和昵称取较高分
+        grams = self.grams(text)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scores = {}
+        for entry, count in shared.items():
+            name, size = self.entries[entry]
+            score = 2 * count / (len(grams) + size)
+            if score >= min_score and score > scores.get(name, 0):
+                scores[name] = score
+        return sorted(scores.items(), key=lambda item: (-item[1], len(item[0]), item[0]))[:limit]
+
+class CharacterRegistry:
+    # 进程内共享的角色表，存储的签名（文件 mtime/size 等）变化或本程序写入时才重新加载
+    def __init__(self, backend):
+        self.backend = backend
+        self._signature = None
+        self._version = 0
+        self._characters = []
+        self._by_name = {}
+        self._nickname_to_name = {}
+        self._exact_names = {}
+        self._name_index = NameTrigramIndex()
+        self._image_paths = {}
+        # 角色名 -> 小整数的驻留表，进程内 id 稳定
+        self._name_table = NameTable()
+        # 拖动排序后尚未写入的顺序
+        self._pending_order = None
+        self._order_writer = WriteBehind(self._write_order)
+        self._checked_at = 0.0
+
+    def _ensure_loaded(self):
+        # 外部改动最多晚 SIGNATURE_CHECK_INTERVAL 秒发现；本程序的写入和 invalidate() 立即生效
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < SIGNATURE_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        signature = self.backend.signature()
+        if self._signature is not None and signature == self._signature:
+            return
+        characters = self.backend.load()
+        if self._pending_order is not None:
+            characters = apply_character_order(characters, self._pending_order)
+        self._rebuild(characters, signature)
+
+    def _rebuild(self, characters, signature):
+        self._characters = characters
+        self._by_name = {char["name"]: char for char in characters}
+        self._nickname_to_name = {char["nickname"].lower(): char["name"] for char in characters
+                                  if char.get("nickname")}
+        self._exact_names = dict(self._nickname_to_name)
+        self._exact_names.update((char["name"].lower(), char["name"]) for char in characters)
+        self._name_index = NameTrigramIndex(self._exact_names.items())
+        self._image_paths = {}
+        for char in characters:
+            img_path = os.path.join(IMG_DIR, char.get("image", ""))
+            if char.get("image") and os.path.exists(img_path):
+                self._image_paths[char["name"]] = img_path
+        self._signature = signature
+        self._version += 1
         for char in characters:
-            if char["name"] == character_name:
-                img_path = os.path.join(IMG_DIR, char["image"])
-                if os.path.exists(img_path):
-                    return img_path
-    except Exception as e:
-        print(f"获取图片路径失败: {e}")
-    return None
-
-class DraggableListWidget(QListWidget):
+            self.intern(char["name"])
+
+    def invalidate(self):
+        self._signature = None
+
+    def intern(self, name):
+        return self._name_table.intern(name)
+
+    def interned_name(self, name_id):
+        return self._name_table.interned_name(name_id)
+
+    def name_list(self):
+        return self._name_table.name_list()
+
+    def version(self):
+        # 每次重新加载或保存后递增，派生缓存据此判断是否需要重建
+        self._ensure_loaded()
+        return self._version
+
+    def characters(self):
+        self._ensure_loaded()
+        return list(self._characters)
+
+    def get(self, name):
+        self._ensure_loaded()
+        return self._by_name.get(name)
+
+    def __contains__(self, name):
+        self._ensure_loaded()
+        return name in self._by_name
+
+    def names(self):
+        self._ensure_loaded()
+        return set(self._by_name)
+
+    def resolve_name(self, term, fuzzy=False):
+        # 昵称换成角色名；fuzzy 时名称和昵称都对不上就取模糊匹配得分最高的角色，仍没有则原样返回
+        self._ensure_loaded()
+        if fuzzy:
+            matches = self.match_names(term, limit=1)
+            return matches[0][0] if matches else term
+        return self._nickname_to_name.get(term.lower(), term)
+
+    def match_names(self, term, limit=5, min_score=0.3):
+        # 名称或昵称完全一致（不区分大小写）时得分为 1，否则按三元组相似度给出候选
+        self._ensure_loaded()
+        exact = self._exact_names.get(term.lower())
+        if exact is not None:
+            return [(exact, 1.0)]
+        return self._name_index.search(term, limit, min_score)
+
+    def nickname_to_name(self):
+        self._ensure_loaded()
+        return dict(self._nickname_to_name)
+
+    def image_path(self, name):
+        self._ensure_loaded()
+        return self._image_paths.get(name)
+
+    def save(self, characters):
+        # 整表保存已包含当前顺序，待写的排序不用再写
+        self._order_writer.cancel()
+        self._pending_order = None
+        self.backend.save(characters)
+        self._rebuild(list(characters), self.backend.signature())
+
+    def reorder(self, names):
+        # 只调整内存中的顺序，位置索引稍后由写回调度写入；顺序不影响派生缓存，版本号不变
+        self._ensure_loaded()
+        self._characters = apply_character_order(self._characters, names)
+        self._pending_order = [char["name"] for char in self._characters]
+        self._order_writer.schedule()
+
+    def flush_order(self):
+        self._order_writer.flush()
+
+    def _write_order(self):
+        if self._pending_order is None:
+            return
+        self.backend.save_order(self._pending_order)
+        self._pending_order = None
+        self._signature = self.backend.signature()
+
+class JsonMatchBackend:
+    # 每次提交都整体重写 matches.json（临时文件 + fsync + 替换）；加载时若有日志模式遗留的日志则合并进来。
+    # 各后端的 commit 接收一组与日志行格式相同的操作，一组只做一次持久写
+    def __init__(self, path, journal_path):
+        self.path = path
+        self.journal_path = journal_path
+
+    def signature(self):
+        return (file_signature(self.path), file_signature(self.journal_path))
+
+    def read_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                matches = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取战绩数据失败: {e}")
+            matches = []
+        return matches
+
+    def replay_journal(self, matches):
+        # 逐行重放日志；遇到崩溃留下的半行即停止，并把日志截断到最后一条完整记录
+        try:
+            f = open(self.journal_path, "rb")
+        except OSError:
+            return 0
+        positions = {match.get("id"): pos for pos, match in enumerate(matches)}
+        replayed = 0
+        good_offset = 0
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                kind = op.get("op")
+                if kind == "add" and op["match"]["id"] not in positions:
+                    positions[op["match"]["id"]] = len(matches)
+                    matches.append(op["match"])
+                elif kind == "update" and op["match"]["id"] in positions:
+                    matches[positions[op["match"]["id"]]] = op["match"]
+                elif kind == "delete":
+                    for match_id in op["ids"]:
+                        pos = positions.pop(match_id, None)
+                        if pos is not None:
+                            matches[pos] = None
+                good_offset += len(line)
+                replayed += 1
+            file_size = f.seek(0, os.SEEK_END)
+        if good_offset < file_size:
+            print(f"战绩日志末尾有 {file_size - good_offset} 字节不完整，已丢弃")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_offset)
+        matches[:] = [match for match in matches if match is not None]
+        return replayed
+
+    def load(self):
+        matches = self.read_snapshot()
+        if self.replay_journal(matches):
+            self.write_snapshot(matches)
+            os.remove(self.journal_path)
+        return matches
+
+    def write_snapshot(self, matches):
+        write_json_atomic(self.path, [dict(match) for match in matches])
+
+    def commit(self, matches, ops):
+        self.write_snapshot(matches)
+
+    def compact(self, matches):
+        pass
+
+class MatchJournalBackend(JsonMatchBackend):
+    # 新增/编辑/删除只追加一行日志，累计到阈值后压缩成 matches.json 快照并清空日志
+    COMPACT_THRESHOLD = 1000
+
+    def __init__(self, path, journal_path):
+        super().__init__(path, journal_path)
+        self.pending_ops = 0
+
+    def load(self):
+        matches = self.read_snapshot()
+        self.pending_ops = self.replay_journal(matches)
+        if self.pending_ops >= self.COMPACT_THRESHOLD:
+            self.write_snapshot(matches)
+        return matches
+
+    def write_snapshot(self, matches):
+        write_json_atomic(self.path, [dict(match) for match in matches])
+        with open(self.journal_path, "wb"):
+            pass
+        self.pending_ops = 0
+
+    def commit(self, matches, ops):
+        # 这一组会让日志达到阈值时直接写快照，不再先追加日志，仍只有一次持久写
+        if self.pending_ops + len(ops) >= self.COMPACT_THRESHOLD:
+            self.write_snapshot(matches)
+            return
+        data = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops).encode("utf-8")
+        with open(self.journal_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending_ops += len(ops)
+
+    def compact(self, matches):
+        if self.pending_ops:
+            self.write_snapshot(matches)
+
+class SqliteDatabase:
+    # 可选的 SQLite 存储：角色和战绩各一张表，队伍以 JSON 数组存在战绩行里；按角色查找走内存中的 MatchIndex
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS characters (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            nickname TEXT NOT NULL DEFAULT '',
+            type TEXT NOT NULL DEFAULT '',
+            rank TEXT NOT NULL DEFAULT '',
+            image TEXT NOT NULL DEFAULT '',
+            rl2 REAL NOT NULL DEFAULT 0,
+            rl25 REAL NOT NULL DEFAULT 0,
+            rl3 REAL NOT NULL DEFAULT 0,
+            rl35 REAL NOT NULL DEFAULT 0,
+            rl4 REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY,
+            result TEXT NOT NULL DEFAULT '',
+            notes TEXT NOT NULL DEFAULT '',
+            team_a TEXT NOT NULL DEFAULT '[]',
+            team_b TEXT NOT NULL DEFAULT '[]',
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # 主线程专用；后台加载线程用 connect() 另开连接
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate_member_table()
+
+    def _migrate_member_table(self):
+        # 旧库把队伍成员逐个存在带角色索引的 match_member 表里，每次增删改都要维护它和索引，
+        # 而查找早已走内存索引；这里把队伍并回 matches 的两列后删掉旧表
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(matches)")}
+        if "team_a" in columns:
+            return
+        with self.conn:
+            self.conn.execute("ALTER TABLE matches ADD COLUMN team_a TEXT NOT NULL DEFAULT '[]'")
+            self.conn.execute("ALTER TABLE matches ADD COLUMN team_b TEXT NOT NULL DEFAULT '[]'")
+            teams = {}
+            for match_id, side, character in self.conn.execute(
+                    "SELECT match_id, side, character FROM match_member ORDER BY match_id, side, slot"):
+                teams.setdefault(match_id, ([], []))[side == "d"].append(character)
+            self.conn.executemany(
+                "UPDATE matches SET team_a = ?, team_b = ? WHERE id = ?",
+                [(json.dumps(team_a, ensure_ascii=False), json.dumps(team_b, ensure_ascii=False), match_id)
+                 for match_id, (team_a, team_b) in teams.items()])
+            self.conn.execute("DROP TABLE match_member")
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def data_version(self):
+        # 只有其他连接提交时才会变化，本连接自己的写入不会触发重新加载
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+class SqliteCharacterBackend:
+    RL_COLUMNS = [("2RL", "rl2"), ("2.5RL", "rl25"), ("3RL", "rl3"), ("3.5RL", "rl35"), ("4RL", "rl4")]
+
+    def __init__(self, db):
+        self.db = db
+
+    def signature(self):
+        return ("sqlite", self.db.data_version())
+
+    def load(self):
+        rows = self.db.conn.execute(
+            "SELECT name, nickname, type, rank, image, rl2, rl25, rl3, rl35, rl4 FROM characters ORDER BY position")
+        characters = []
+        for name, nickname, char_type, rank, image, *rl_values in rows:
+            char = {"name": name, "nickname": nickname, "type": char_type, "rank": rank, "image": image}
+            for (key, _), value in zip(self.RL_COLUMNS, rl_values):
+                char[key] = value
+            characters.append(char)
+        return characters
+
+    def save(self, characters):
+        with self.db.conn:
+            self.db.conn.execute("DELETE FROM characters")
+            self.db.conn.executemany(
+                "INSERT INTO characters (name, position, nickname, type, rank, image, rl2, rl25, rl3, rl35, rl4) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(char["name"], position, char.get("nickname", ""), char.get("type", ""), char.get("rank", ""),
+                  char.get("image", ""), *(float(char.get(key, 0) or 0) for key, _ in self.RL_COLUMNS))
+                 for position, char in enumerate(characters)])
+
+    def save_order(self, names):
+        # 只更新位置变了的行
+        with self.db.conn:
+            self.db.conn.executemany(
+                "UPDATE characters SET position = ? WHERE name = ? AND position != ?",
+                [(position, name, position) for position, name in enumerate(names)])
+
+class SqliteMatchBackend:
+    BASE_KEYS = {"id", "team_a", "team_b", "result", "notes"}
+    # data_version 按连接计数，签名只能在主线程的连接上取；后台加载时由主线程在启动前取好
+    SIGNATURE_ON_MAIN_THREAD = True
+
+    def __init__(self, db):
+        self.db = db
+
+    def signature(self):
+        return ("sqlite", self.db.data_version())
+
+    def load(self):
+        if threading.current_thread() is threading.main_thread():
+            return self._load(self.db.conn)
+        conn = self.db.connect()
+        try:
+            return self._load(conn)
+        finally:
+            conn.close()
+
+    def _load(self, conn):
+        matches = []
+        for match_id, result, notes, team_a, team_b, extra in conn.execute(
+                "SELECT id, result, notes, team_a, team_b, extra FROM matches ORDER BY id"):
+            match = {"team_a": json.loads(team_a), "team_b": json.loads(team_b), "result": result, "notes": notes}
+            if extra:
+                match.update(json.loads(extra))
+            match["id"] = match_id
+            matches.append(match)
+        return matches
+
+    def _insert(self, records):
+        self.db.conn.executemany(
+            "INSERT INTO matches (id, result, notes, team_a, team_b, extra) VALUES (?, ?, ?, ?, ?, ?)",
+            [(record["id"], record.get("result", ""), record.get("notes", ""),
+              json.dumps(record.get("team_a", []), ensure_ascii=False),
+              json.dumps(record.get("team_b", []), ensure_ascii=False),
+              json.dumps({key: value for key, value in record.items() if key not in self.BASE_KEYS},
+                         ensure_ascii=False) if set(record) - self.BASE_KEYS else None)
+             for record in records])
+
+    def _delete(self, match_ids):
+        conn = self.db.conn
+        for start in range(0, len(match_ids), 500):
+            chunk = list(match_ids[start:start + 500])
+            placeholders = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM matches WHERE id IN ({placeholders})", chunk)
+
+    def commit(self, matches, ops):
+        # 一组操作放在同一个事务里，连续的新增合并成一次批量插入
+        added = []
+        with self.db.conn:
+            for op in ops:
+                if op["op"] == "add":
+                    added.append(op["match"])
+                    continue
+                if added:
+                    self._insert(added)
+                    added = []
+                if op["op"] == "update":
+                    self._delete([op["match"]["id"]])
+                    self._insert([op["match"]])
+                elif op["op"] == "delete":
+                    self._delete(op["ids"])
+            if added:
+                self._insert(added)
+
+    def write_snapshot(self, matches):
+        with self.db.conn:
+            self.db.conn.execute("DELETE FROM matches")
+            self._insert(matches)
+
+    def compact(self, matches):
+        pass
+
+def migrate_json_to_sqlite(db):
+    # 首次使用 SQLite 时一次性导入 characters.json / matches.json（含未压缩的日志）
+    if db.get_meta("migrated_from_json"):
+        return False
+    has_data = db.conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM characters) OR EXISTS (SELECT 1 FROM matches)").fetchone()[0]
+    if not has_data:
+        characters = JsonCharacterBackend(CHAR_FILE, CHAR_ORDER_FILE).load()
+        json_backend = JsonMatchBackend(MATCH_FILE, MATCH_JOURNAL_FILE)
+        matches = json_backend.read_snapshot()
+        json_backend.replay_journal(matches)
+        backfill_match_ids(matches)
+        SqliteCharacterBackend(db).save(characters)
+        SqliteMatchBackend(db).write_snapshot(matches)
+        print(f"已迁移 {len(characters)} 个角色和 {len(matches)} 条战绩到 {db.path}")
+    with db.conn:
+        db.set_meta("migrated_from_json", "1")
+    return not has_data
+
+STORAGE_MODES = ["json", "journal", "sqlite", "archive"]
+
+def create_storage_backends(mode):
+    # 返回 (角色后端, 战绩后端)；sqlite 模式下角色和战绩都存放在 DB_FILE 中
+    if mode == "sqlite":
+        db = SqliteDatabase(DB_FILE)
+        migrate_json_to_sqlite(db)
+        return SqliteCharacterBackend(db), SqliteMatchBackend(db)
+    if mode == "journal":
+        return JsonCharacterBackend(CHAR_FILE, CHAR_ORDER_FILE), MatchJournalBackend(MATCH_FILE, MATCH_JOURNAL_FILE)
+    if mode == "archive":
+        migrate_json_to_archive()
+        return JsonCharacterBackend(CHAR_FILE, CHAR_ORDER_FILE), ArchiveMatchBackend(MATCH_ARCHIVE_FILE, MATCH_ARCHIVE_JOURNAL_FILE)
+    return JsonCharacterBackend(CHAR_FILE, CHAR_ORDER_FILE), JsonMatchBackend(MATCH_FILE, MATCH_JOURNAL_FILE)
+
+def posting_add(posting, match_id):
+    if not posting or posting[-1] < match_id:
+        posting.append(match_id)
+    else:
+        pos = bisect.bisect_left(posting, match_id)
+        if pos == len(posting) or posting[pos] != match_id:
+            posting.insert(pos, match_id)
+
+def posting_discard(posting, match_id):
+    pos = bisect.bisect_left(posting, match_id)
+    if pos < len(posting) and posting[pos] == match_id:
+        del posting[pos]
+
+def intersect_postings(posting_lists):
+    # 从最短的倒排表开始逐个求交，较长的表用二分查找并单调推进下界
+    lists = sorted(posting_lists, key=len)
+    if not lists:
+        return []
+    result = list(lists[0])
+    for other in lists[1:]:
+        if not result:
+            break
+        kept = []
+        lo = 0
+        for match_id in result:
+            lo = bisect.bisect_left(other, match_id, lo)
+            if lo == len(other):
+                break
+            if other[lo] == match_id:
+                kept.append(match_id)
+        result = kept
+    return result
+
+def union_postings(posting_lists):
+    return sorted(set().union(*posting_lists))
+
+class MatchIndex:
+    # 角色名（小写）-> 按 id 升序的战绩 id 倒排表，进攻/防守/任一方各一份，随增删改增量维护
+    def __init__(self):
+        self.postings = {"a": {}, "d": {}, "any": {}}
+
+    @staticmethod
+    def _names(match):
+        team_a = {name.lower() for name in match.get("team_a", []) if name}
+        team_b = {name.lower() for name in match.get("team_b", []) if name}
+        return {"a": team_a, "d": team_b, "any": team_a | team_b}
+
+    def _insert(self, match):
+        match_id = match["id"]
+        for side, names in self._names(match).items():
+            for name in names:
+                posting_add(self.postings[side].setdefault(name, []), match_id)
+
+    def _remove(self, match):
+        match_id = match["id"]
+        for side, names in self._names(match).items():
+            for name in names:
+                posting = self.postings[side].get(name)
+                if posting is None:
+                    continue
+                posting_discard(posting, match_id)
+                if not posting:
+                    del self.postings[side][name]
+
+    def reset(self, matches):
+        self.postings = {"a": {}, "d": {}, "any": {}}
+        for match in matches:
+            match_id = match["id"]
+            for side, names in self._names(match).items():
+                for name in names:
+                    self.postings[side].setdefault(name, []).append(match_id)
+        for side_postings in self.postings.values():
+            for posting in side_postings.values():
+                posting.sort()
+
+    def added(self, records):
+        for record in records:
+            self._insert(record)
+
+    def updated(self, old, new):
+        self._remove(old)
+        self._insert(new)
+
+    def deleted(self, records):
+        for record in records:
+            self._remove(record)
+
+    def ids(self, name, side=None):
+        return self.postings["any" if side is None else side].get(name.lower(), [])
+
+class NotesNgramIndex:
+    # 备注的单字 + 相邻二字（bigram）倒排索引；中文备注没有分词边界，按字切分即可。
+    # 索引连同内容指纹一起保存到 NOTES_INDEX_FILE，指纹一致时启动不必重建
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.postings = {}
+        self._dirty = False
+
+    @staticmethod
+    def grams(text):
+        text = text.lower()
+        return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+    @staticmethod
+    def fingerprint(matches):
+        digest = hashlib.sha1()
+        for match in matches:
+            digest.update(f"{match['id']}\x00{match.get('notes', '')}\x01".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _load_persisted(self, fingerprint):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if data.get("version") != self.VERSION or data.get("fingerprint") != fingerprint:
+            return False
+        self.postings = data["postings"]
+        return True
+
+    def reset(self, matches):
+        if self._load_persisted(self.fingerprint(matches)):
+            self._dirty = False
+            return
+        self.postings = {}
+        for match in matches:
+            for gram in self.grams(match.get("notes", "")):
+                self.postings.setdefault(gram, []).append(match["id"])
+        for posting in self.postings.values():
+            posting.sort()
+        self._dirty = True
+
+    def _insert(self, match):
+        for gram in self.grams(match.get("notes", "")):
+            posting_add(self.postings.setdefault(gram, []), match["id"])
+
+    def _remove(self, match):
+        for gram in self.grams(match.get("notes", "")):
+            posting = self.postings.get(gram)
+            if posting is None:
+                continue
+            posting_discard(posting, match["id"])
+            if not posting:
+                del self.postings[gram]
+
+    def added(self, records):
+        for record in records:
+            self._insert(record)
+        self._dirty = True
+
+    def updated(self, old, new):
+        if old.get("notes", "") != new.get("notes", ""):
+            self._remove(old)
+            self._insert(new)
+            self._dirty = True
+
+    def deleted(self, records):
+        for record in records:
+            self._remove(record)
+        self._dirty = True
+
+    def estimate(self, text):
+        # 候选数的上界：各 gram 倒排表中最短的长度
+        text = text.lower()
+        grams = [text] if len(text) < 2 else [text[i:i + 2] for i in range(len(text) - 1)]
+        return min(len(self.postings.get(gram, ())) for gram in grams)
+
+    def candidates(self, text):
+        # 返回可能包含 text 的战绩 id（升序）；调用方还需做一次子串校验
+        text = text.lower()
+        if len(text) < 2:
+            return list(self.postings.get(text, []))
+        posting_lists = []
+        for i in range(len(text) - 1):
+            posting = self.postings.get(text[i:i + 2])
+            if posting is None:
+                return []
+            posting_lists.append(posting)
+        return intersect_postings(posting_lists)
+
+    def flush(self, matches):
+        if not self._dirty:
+            return
+        try:
+            write_json_atomic(self.path, {"version": self.VERSION, "fingerprint": self.fingerprint(matches),
+                                          "postings": self.postings}, indent=None)
+            self._dirty = False
+        except OSError as e:
+            print(f"保存备注索引失败: {e}")
+
+    def memory_footprint(self):
+        # 估算：dict 本身 + 每个 gram 字符串 + 每个倒排表（指针数组，id 整数对象各表共享不重复计）
+        total = sys.getsizeof(self.postings)
+        entries = 0
+        for gram, posting in self.postings.items():
+            total += sys.getsizeof(gram) + sys.getsizeof(posting)
+            entries += len(posting)
+        return {"grams": len(self.postings), "entries": entries, "bytes": total}
+
+def wilson_lower_bound(wins, attempts, z=1.96):
+    # 胜率的 Wilson 区间下界：同样 100% 胜率，场次越多排得越前
+    if attempts <= 0:
+        return 0.0
+    rate = wins / attempts
+    denominator = 1 + z * z / attempts
+    center = rate + z * z / (2 * attempts)
+    margin = z * math.sqrt(rate * (1 - rate) / attempts + z * z / (4 * attempts * attempts))
+    return (center - margin) / denominator
+
+class DefenseOutcomeIndex:
+    # 防守阵容 -> {进攻阵容: [胜, 场, 名单]} 的聚合，阵容按成员小写集合计、与站位顺序无关，随增删改增量维护；
+    # 另有 角色 -> 含该角色的防守阵容 倒排，用来找成员重叠的相似防守
+    def __init__(self):
+        self.outcomes = {}
+        self.by_member = {}
+
+    @staticmethod
+    def team_key(team):
+        return frozenset(name.lower() for name in team if name)
+
+    def _apply(self, match, delta):
+        defense = self.team_key(match.get("team_b", []))
+        attack = self.team_key(match.get("team_a", []))
+        if not defense or not attack:
+            return
+        attacks = self.outcomes.get(defense)
+        if attacks is None:
+            attacks = self.outcomes[defense] = {}
+            for name in defense:
+                self.by_member.setdefault(name, set()).add(defense)
+        counts = attacks.get(attack)
+        if counts is None:
+            counts = attacks[attack] = [0, 0, [name for name in match.get("team_a", []) if name]]
+        counts[0] += delta if match.get("result") == "胜" else 0
+        counts[1] += delta
+        if counts[1] > 0:
+            return
+        del attacks[attack]
+        if attacks:
+            return
+        del self.outcomes[defense]
+        for name in defense:
+            keys = self.by_member[name]
+            keys.discard(defense)
+            if not keys:
+                del self.by_member[name]
+
+    def reset(self, matches):
+        self.outcomes = {}
+        self.by_member = {}
+        for match in matches:
+            self._apply(match, 1)
+
+    def added(self, records):
+        for record in records:
+            self._apply(record, 1)
+
+    def updated(self, old, new):
+        self._apply(old, -1)
+        self._apply(new, 1)
+
+    def deleted(self, records):
+        for record in records:
+            self._apply(record, -1)
+
+    def attacks(self, defense):
+        # 与这套防守成员完全一致的历史进攻：{进攻阵容: [胜, 场, 名单]}，调用方不要修改
+        return self.outcomes.get(self.team_key(defense), {})
+
+    def recommend(self, defense, top_k=10, min_similarity=0.4):
+        # 相似防守（Jaccard 相似度 ≥ min_similarity）上的战绩按相似度加权汇总到进攻阵容，
+        # 再按加权胜率的 Wilson 下界取前 k 名
+        query = self.team_key(defense)
+        if not query:
+            return []
+        overlaps = {}
+        for name in query:
+            for key in self.by_member.get(name, ()):
+                overlaps[key] = overlaps.get(key, 0) + 1
+        totals = {}
+        for key, overlap in overlaps.items():
+            similarity = overlap / (len(query) + len(key) - overlap)
+            if similarity < min_similarity:
+                continue
+            exact = key == query
+            for attack, (wins, attempts, names) in self.outcomes[key].items():
+                entry = totals.get(attack)
+                if entry is None:
+                    entry = totals[attack] = [0.0, 0.0, 0, 0, names]
+                entry[0] += similarity * wins
+                entry[1] += similarity * attempts
+                if exact:
+                    entry[2] += wins
+                    entry[3] += attempts
+        best = heapq.nlargest(top_k, totals.values(),
+                              key=lambda entry: (wilson_lower_bound(entry[0], entry[1]), entry[3], entry[1]))
+        return [{
+            "team_a": list(names),
+            "score": wilson_lower_bound(weighted_wins, weighted_attempts),
+            "win_rate": weighted_wins / weighted_attempts,
+            "weighted_attempts": weighted_attempts,
+            "exact_wins": exact_wins,
+            "exact_attempts": exact_attempts,
+        } for weighted_wins, weighted_attempts, exact_wins, exact_attempts, names in best]
+
+class MatchStatistics:
+    # 物化的胜率统计：角色进攻/防守的 [胜, 场]，以及 进攻角色 × 防守角色 的对位 [进攻胜, 场]。
+    # 增删改只按差量更新；连同内容指纹保存到 MATCH_STATS_FILE，启动时指纹一致即直接载入。
+    # rebuild() 是从头计数的实现，用于校验和指纹不一致时的重建
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.attack = {}
+        self.defense = {}
+        self.matchups = {}
+        self._dirty = False
+
+    @staticmethod
+    def fingerprint(matches):
+        digest = hashlib.sha1()
+        for match in matches:
+            digest.update(f"{match['id']}\x00{match.get('team_a_fp')}\x00{match.get('team_b_fp')}\x00"
+                          f"{match.get('result', '')}\x01".encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _count(table, key, won, delta):
+        counts = table.get(key)
+        if counts is None:
+            counts = table[key] = [0, 0]
+        counts[0] += delta if won else 0
+        counts[1] += delta
+        if counts[1] == 0:
+            del table[key]
+
+    def _apply(self, match, delta):
+        team_a = {name for name in match.get("team_a", []) if name}
+        team_b = {name for name in match.get("team_b", []) if name}
+        won = match.get("result") == "胜"
+        for name in team_a:
+            self._count(self.attack, name, won, delta)
+            row = self.matchups.setdefault(name, {})
+            for defender in team_b:
+                self._count(row, defender, won, delta)
+            if not row:
+                del self.matchups[name]
+        for name in team_b:
+            self._count(self.defense, name, not won, delta)
+
+    @staticmethod
+    def rebuild(matches):
+        # 把战绩编码成整数矩阵（每行 width 个进攻槽 + width 个防守槽，空位 -1）和结果列，再整列计数
+        names = {}
+        encoded = []
+        width = 1
+        for match in matches:
+            team_a = [names.setdefault(name, len(names)) for name in dict.fromkeys(match.get("team_a", [])) if name]
+            team_b = [names.setdefault(name, len(names)) for name in dict.fromkeys(match.get("team_b", [])) if name]
+            width = max(width, len(team_a), len(team_b))
+            encoded.append((team_a, team_b))
+        grid = array("i")
+        results = array("b")
+        for (team_a, team_b), match in zip(encoded, matches):
+            grid.extend(team_a + [-1] * (width - len(team_a)) + team_b + [-1] * (width - len(team_b)))
+            results.append(match.get("result") == "胜")
+        stride = 2 * width
+        attack_slots = [grid[i::stride] for i in range(width)]
+        defense_slots = [grid[width + i::stride] for i in range(width)]
+        attack_attempts = Counter()
+        attack_wins = Counter()
+        defense_attempts = Counter()
+        defense_losses = Counter()
+        for slot in attack_slots:
+            attack_attempts.update(slot)
+            attack_wins.update(compress(slot, results))
+        for slot in defense_slots:
+            defense_attempts.update(slot)
+            defense_losses.update(compress(slot, results))
+        # 对位：进攻槽 i × 防守槽 j 的整数对编码 a * n + d
+        n = len(names)
+        pair_attempts = Counter()
+        pair_wins = Counter()
+        for attack_slot in attack_slots:
+            for defense_slot in defense_slots:
+                pairs = [a * n + d for a, d in zip(attack_slot, defense_slot) if a >= 0 and d >= 0]
+                wins = [a * n + d for a, d, won in zip(attack_slot, defense_slot, results)
+                        if won and a >= 0 and d >= 0]
+                pair_attempts.update(pairs)
+                pair_wins.update(wins)
+        by_code = list(names)
+        attack = {by_code[code]: [attack_wins[code], count] for code, count in attack_attempts.items() if code >= 0}
+        defense = {by_code[code]: [count - defense_losses[code], count]
+                   for code, count in defense_attempts.items() if code >= 0}
+        matchups = {}
+        for code, count in pair_attempts.items():
+            attacker, defender = divmod(code, n)
+            matchups.setdefault(by_code[attacker], {})[by_code[defender]] = [pair_wins[code], count]
+        return attack, defense, matchups
+
+    def _load_persisted(self, fingerprint):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if data.get("version") != self.VERSION or data.get("fingerprint") != fingerprint:
+            return False
+        self.attack = data["attack"]
+        self.defense = data["defense"]
+        self.matchups = data["matchups"]
+        return True
+
+    def reset(self, matches):
+        if self._load_persisted(self.fingerprint(matches)):
+            self._dirty = False
+            return
+        self.attack, self.defense, self.matchups = self.rebuild(matches)
+        self._dirty = True
+
+    def added(self, records):
+        for record in records:
+            self._apply(record, 1)
+        self._dirty = True
+
+    def updated(self, old, new):
+        self._apply(old, -1)
+        self._apply(new, 1)
+        self._dirty = True
+
+    def deleted(self, records):
+        for record in records:
+            self._apply(record, -1)
+        self._dirty = True
+
+    def verify(self, matches):
+        # 与从头重建的结果比对，返回各部分不一致的角色（全空表示一致）
+        attack, defense, matchups = self.rebuild(matches)
+        mismatches = {}
+        for part, rebuilt, current in (("attack", attack, self.attack), ("defense", defense, self.defense),
+                                       ("matchups", matchups, self.matchups)):
+            mismatches[part] = sorted(name for name in set(rebuilt) | set(current)
+                                      if rebuilt.get(name) != current.get(name))
+        return mismatches
+
+    def flush(self, matches):
+        if not self._dirty:
+            return
+        try:
+            write_json_atomic(self.path, {"version": self.VERSION, "fingerprint": self.fingerprint(matches),
+                                          "attack": self.attack, "defense": self.defense,
+                                          "matchups": self.matchups}, indent=None)
+            self._dirty = False
+        except OSError as e:
+            print(f"保存战绩统计失败: {e}")
+
+RESULT_CODES = {"胜": 1, "败": 2}
+RESULT_NAMES = {code: result for result, code in RESULT_CODES.items()}
+_MISSING = object()
+
+class MatchRecordView(Mapping):
+    # 紧凑表里一条战绩的只读字典视图，按 id 定位，随表更新；需要可修改的副本时用 dict(view)
+    __slots__ = ("_table", "_id")
+
+    def __init__(self, table, match_id):
+        self._table = table
+        self._id = match_id
+
+    def __getitem__(self, key):
+        return self._table.field(self._id, key)
+
+    def __iter__(self):
+        return iter(self._table.keys(self._id))
+
+    def __len__(self):
+        return len(self._table.keys(self._id))
+
+    def __repr__(self):
+        return f"MatchRecordView({dict(self)!r})"
+
+class CompactMatchTable:
+    # 战绩的紧凑内存表示：角色名经角色表驻留成小整数，每条战绩占 2×5 个 uint16 槽（0 为空位），
+    # 结果一个字节，两队指纹各一个 uint64，备注放在独立的字符串表（相同内容共用一个对象）。
+    # 放不进这些列的值（超过 5 人、非标准结果、缺失或未知字段等）按 id 原样存进 extras，保证无损
+    BASE_KEYS = ("team_a", "team_b", "result", "notes", "id", "team_a_fp", "team_b_fp")
+
+    def __init__(self, registry, records=()):
+        self.registry = registry
+        self.ids = array("q")
+        self.teams = array("H")
+        self.results = array("B")
+        self.fingerprints = array("Q")
+        self.notes = []
+        self.extras = {}
+        self.positions = {}
+        self._note_pool = {}
+        self.extend(records)
+
+    @classmethod
+    def from_archive(cls, registry, reader):
+        # 直接搬运归档里的各列，只把归档自己的名称编号换成 registry 的编号
+        table = cls(registry)
+        translate = [0] + [registry.intern(name) for name in reader.names[1:]]
+        table.ids = array("q", reader.ids)
+        table.teams = array("H", [translate[slot] for slot in reader.team_slots()])
+        table.results = array("B", reader.results)
+        table.fingerprints = array("Q", reader.fingerprints)
+        # 表以后会追加备注，复制一份列表（只复制引用，不再解码）
+        table.notes = list(reader.note_list())
+        table._note_pool = {note: note for note in table.notes}
+        table.positions = {match_id: pos for pos, match_id in enumerate(table.ids)}
+        for match_id, extra in reader.extras().items():
+            values = dict(extra.get("values", {}))
+            values.update((key, _MISSING) for key in extra.get("missing", []))
+            table.extras[match_id] = values
+        return table
+
+    def rebind(self, registry):
+        # 表建在私有 NameTable 上时（后台加载），装入前把名称编号换成 registry 的编号
+        translate = [0] + [registry.intern(name) for name in self.registry.names()]
+        self.teams = array("H", [translate[slot] for slot in self.teams.tolist()])
+        self.registry = registry
+
+    def _pack_team(self, team, slots, key, extras):
+        if (isinstance(team, list) and len(team) <= TEAM_SIZE
+                and all(isinstance(name, str) and name for name in team)):
+            slots.extend(self.registry.intern(name) for name in team)
+            slots.extend([0] * (TEAM_SIZE - len(team)))
+        else:
+            slots.extend([0] * TEAM_SIZE)
+            extras[key] = team
+
+    @staticmethod
+    def _pack_fingerprint(value, key, extras):
+        if isinstance(value, str) and len(value) == 16:
+            try:
+                return int(value, 16)
+            except ValueError:
+                pass
+        extras[key] = value
+        return 0
+
+    def _pack(self, record):
+        extras = {key: value for key, value in record.items() if key not in self.BASE_KEYS}
+        slots = []
+        self._pack_team(record.get("team_a", _MISSING), slots, "team_a", extras)
+        self._pack_team(record.get("team_b", _MISSING), slots, "team_b", extras)
+        result = record.get("result", _MISSING)
+        result_code = RESULT_CODES.get(result, 0) if isinstance(result, str) else 0
+        if not result_code:
+            extras["result"] = result
+        notes = record.get("notes", _MISSING)
+        if isinstance(notes, str):
+            notes = self._note_pool.setdefault(notes, notes)
+        else:
+            extras["notes"] = notes
+            notes = ""
+        fingerprints = (self._pack_fingerprint(record.get("team_a_fp", _MISSING), "team_a_fp", extras),
+                        self._pack_fingerprint(record.get("team_b_fp", _MISSING), "team_b_fp", extras))
+        return slots, result_code, notes, fingerprints, extras
+
+    def _store_extras(self, match_id, extras):
+        if extras:
+            self.extras[match_id] = extras
+        else:
+            self.extras.pop(match_id, None)
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        for record in records:
+            match_id = record["id"]
+            slots, result_code, notes, fingerprints, extras = self._pack(record)
+            self.positions[match_id] = len(self.ids)
+            self.ids.append(match_id)
+            self.teams.extend(slots)
+            self.results.append(result_code)
+            self.notes.append(notes)
+            self.fingerprints.extend(fingerprints)
+            self._store_extras(match_id, extras)
+
+    def replace(self, pos, record):
+        # 覆盖第 pos 行，id 不变
+        match_id = self.ids[pos]
+        slots, result_code, notes, fingerprints, extras = self._pack(dict(record, id=match_id))
+        self.teams[pos * 2 * TEAM_SIZE:(pos + 1) * 2 * TEAM_SIZE] = array("H", slots)
+        self.results[pos] = result_code
+        self.notes[pos] = notes
+        self.fingerprints[pos * 2:pos * 2 + 2] = array("Q", fingerprints)
+        self._store_extras(match_id, extras)
+
+    def remove(self, match_ids):
+        # 删除多条时整列过滤一次，少量时逐行删除
+        positions = sorted((self.positions[match_id] for match_id in match_ids), reverse=True)
+        if not positions:
+            return
+        if len(positions) > 16:
+            dropped = set(positions)
+            keep = [pos for pos in range(len(self.ids)) if pos not in dropped]
+            width = 2 * TEAM_SIZE
+            self.ids = array("q", (self.ids[pos] for pos in keep))
+            self.teams = array("H", (slot for pos in keep for slot in self.teams[pos * width:(pos + 1) * width]))
+            self.results = array("B", (self.results[pos] for pos in keep))
+            self.fingerprints = array("Q", (value for pos in keep for value in self.fingerprints[pos * 2:pos * 2 + 2]))
+            self.notes = [self.notes[pos] for pos in keep]
+        else:
+            for pos in positions:
+                del self.ids[pos]
+                del self.teams[pos * 2 * TEAM_SIZE:(pos + 1) * 2 * TEAM_SIZE]
+                del self.results[pos]
+                del self.fingerprints[pos * 2:pos * 2 + 2]
+                del self.notes[pos]
+        for match_id in match_ids:
+            del self.positions[match_id]
+            self.extras.pop(match_id, None)
+        for pos in range(positions[-1], len(self.ids)):
+            self.positions[self.ids[pos]] = pos
+
+    def _team(self, pos, side):
+        start = pos * 2 * TEAM_SIZE + side * TEAM_SIZE
+        names = self.registry.name_list()
+        return [names[slot] for slot in self.teams[start:start + TEAM_SIZE] if slot]
+
+    def field(self, match_id, key):
+        pos = self.positions[match_id]
+        extras = self.extras.get(match_id)
+        if extras is not None and key in extras:
+            value = extras[key]
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if key == "id":
+            return match_id
+        if key == "team_a":
+            return self._team(pos, 0)
+        if key == "team_b":
+            return self._team(pos, 1)
+        if key == "result":
+            return RESULT_NAMES[self.results[pos]]
+        if key == "notes":
+            return self.notes[pos]
+        if key == "team_a_fp":
+            return f"{self.fingerprints[pos * 2]:016x}"
+        if key == "team_b_fp":
+            return f"{self.fingerprints[pos * 2 + 1]:016x}"
+        raise KeyError(key)
+
+    def keys(self, match_id):
+        extras = self.extras.get(match_id, {})
+        keys = [key for key in self.BASE_KEYS if extras.get(key) is not _MISSING]
+        keys.extend(key for key, value in extras.items() if key not in self.BASE_KEYS)
+        return keys
+
+    def view(self, match_id):
+        return MatchRecordView(self, match_id) if match_id in self.positions else None
+
+    def record(self, pos):
+        # 第 pos 行的普通字典副本
+        return dict(MatchRecordView(self, self.ids[pos]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [MatchRecordView(self, match_id) for match_id in self.ids[pos]]
+        return MatchRecordView(self, self.ids[pos])
+
+    def __iter__(self):
+        return (MatchRecordView(self, match_id) for match_id in self.ids)
+
+def match_memory_benchmark(count=100000):
+    # 同一批模拟战绩分别以 JSON 解析出的字典列表和紧凑表保存，用 tracemalloc 比较常驻内存
+    import gc
+    import random
+    import tracemalloc
+    names = sorted(character_registry.names()) or [f"角色{i}" for i in range(150)]
+    rng = random.Random(0)
+    notes = ["", "", "", "先手爆裂", "注意开局站位", "对面练度高"]
+    payload = json.dumps([{
+        "team_a": rng.sample(names, min(TEAM_SIZE, len(names))),
+        "team_b": rng.sample(names, min(TEAM_SIZE, len(names))),
+        "result": rng.choice(["胜", "败"]),
+        "notes": rng.choice(notes) + (f" #{match_id}" if match_id % 4 == 0 else ""),
+        "id": match_id,
+    } for match_id in range(1, count + 1)], ensure_ascii=False)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = json.loads(payload)
+    for record in records:
+        stamp_team_fingerprints(record)
+    dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    table = CompactMatchTable(character_registry, records)
+    del records
+    gc.collect()
+    compact_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {"matches": len(table), "dict_bytes": dict_bytes, "compact_bytes": compact_bytes,
+            "dict_per_match": dict_bytes / count, "compact_per_match": compact_bytes / count}
+
+class NameTable:
+    # 名称 -> 小整数的驻留表，只增不减；0 留作空位
+    def __init__(self):
+        self._ids = {}
+        self._names = [""]
+
+    def intern(self, name):
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def interned_name(self, name_id):
+        return self._names[name_id]
+
+    def name_list(self):
+        # 编号 -> 名称的列表本身（不复制），批量解码时直接下标取，调用方不要修改
+        return self._names
+
+    def names(self):
+        return self._names[1:]
+
+class MatchArchiveReader:
+    # 用 mmap 打开战绩归档：各列是 mmap 上的 memoryview，不必先整体读进内存。
+    # 归档只是紧凑的磁盘格式，加载时仍由 records()/CompactMatchTable.from_archive 整列解码成内存表
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"战绩归档为空: {path}")
+        try:
+            self._open_sections()
+        except Exception:
+            self.close()
+            raise
+
+    def _open_sections(self):
+        buf = memoryview(self._mmap)
+        # 先登记，头部校验失败时 close() 也能释放它再关闭 mmap
+        self._views = [buf]
+        if len(buf) < MATCH_ARCHIVE_HEADER.size:
+            raise ValueError("战绩归档头部不完整")
+        magic, version, _, count, name_count, *offsets = MATCH_ARCHIVE_HEADER.unpack_from(buf)
+        if magic != MATCH_ARCHIVE_MAGIC:
+            raise ValueError("不是战绩归档文件")
+        if version != MATCH_ARCHIVE_VERSION:
+            raise ValueError(f"不支持的战绩归档版本: {version}")
+        if offsets[-1] != len(buf):
+            raise ValueError("战绩归档长度与头部不符")
+        sections = [buf[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        name_offsets, name_blob, ids, teams, results, fingerprints, note_offsets, note_blob, extras = sections
+        self.count = count
+        self._views = [buf] + sections
+        self.ids = self._cast(ids, "q", count)
+        self.teams = self._cast(teams, "H", count * 2 * TEAM_SIZE)
+        self.results = self._cast(results, "B", count)
+        self.fingerprints = self._cast(fingerprints, "Q", count * 2)
+        self._note_offsets = self._cast(note_offsets, "Q", count + 1)
+        self._note_blob = note_blob
+        self._extras_blob = extras
+        self._extras = None
+        # 解码后的列缓存：records() 与 CompactMatchTable.from_archive 共用，打开归档时每列只解码一次
+        self._note_list = None
+        self._team_slots = None
+        name_offsets = self._cast(name_offsets, "I", name_count + 1)
+        self.names = [""] + [bytes(name_blob[name_offsets[i]:name_offsets[i + 1]]).decode("utf-8")
+                             for i in range(name_count)]
+
+    def _cast(self, view, fmt, length):
+        if len(view) != length * struct.calcsize(fmt):
+            raise ValueError("战绩归档分段长度与头部不符")
+        if sys.byteorder == "little":
+            cast = view.cast(fmt)
+            self._views.append(cast)
+            return cast
+        # 归档固定小端；大端机器上复制一份再翻转字节序
+        values = array(fmt, bytes(view))
+        values.byteswap()
+        return values
+
+    def extras(self):
+        if self._extras is None:
+            self._extras = {int(match_id): value for match_id, value in
+                            json.loads(bytes(self._extras_blob).decode("utf-8") or "{}").items()}
+        return self._extras
+
+    def note_list(self):
+        # 全部备注；相同内容只解码一次并共用同一个字符串。调用方不要修改返回的列表
+        if self._note_list is None:
+            note_offsets = self._note_offsets.tolist()
+            note_blob = bytes(self._note_blob)
+            pool = {}
+            notes = []
+            for pos in range(self.count):
+                note = note_blob[note_offsets[pos]:note_offsets[pos + 1]]
+                text = pool.get(note)
+                if text is None:
+                    text = pool[note] = note.decode("utf-8")
+                notes.append(text)
+            self._note_list = notes
+        return self._note_list
+
+    def team_slots(self):
+        # 队伍槽位（归档自己的名称编号）转成的列表，同样只转一次
+        if self._team_slots is None:
+            self._team_slots = self.teams.tolist()
+        return self._team_slots
+
+    def records(self):
+        # 整列一次性转成 Python 对象再拼记录，比逐条 record() 少很多切片
+        names = self.names
+        teams = [names[slot] if slot else None for slot in self.team_slots()]
+        results = [RESULT_NAMES.get(code) for code in self.results.tolist()]
+        fingerprints = [f"{value:016x}" for value in self.fingerprints.tolist()]
+        notes = self.note_list()
+        extras = self.extras() if self._extras_blob else {}
+        width = 2 * TEAM_SIZE
+        records = []
+        for pos, match_id in enumerate(self.ids.tolist()):
+            start = pos * width
+            record = {
+                "team_a": [name for name in teams[start:start + TEAM_SIZE] if name is not None],
+                "team_b": [name for name in teams[start + TEAM_SIZE:start + width] if name is not None],
+                "result": results[pos],
+                "notes": notes[pos],
+                "id": match_id,
+                "team_a_fp": fingerprints[pos * 2],
+                "team_b_fp": fingerprints[pos * 2 + 1],
+            }
+            extra = extras.get(match_id)
+            if extra:
+                record.update(extra.get("values", {}))
+                for key in extra.get("missing", []):
+                    del record[key]
+            records.append(record)
+        return records
+
+    def close(self):
+        for view in reversed(getattr(self, "_views", [])):
+            if isinstance(view, memoryview):
+                view.release()
+        self._views = []
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_match_archive(path, matches):
+    # 借用 CompactMatchTable 按列打包（名称驻留到归档自己的名称表），再依次写出各段；
+    # 与 write_json_atomic 一样先写临时文件、fsync 后替换
+    matches = [dict(match) for match in matches]
+    ids = [match.get("id") for match in matches]
+    if not all(isinstance(match_id, int) for match_id in ids) or len(set(ids)) != len(ids):
+        raise ValueError("战绩归档要求每条战绩都有唯一的整数 id")
+    table = CompactMatchTable(NameTable(), matches)
+    names = [name.encode("utf-8") for name in table.registry.names()]
+    name_offsets = array("I", [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    notes = [note.encode("utf-8") for note in table.notes]
+    note_offsets = array("Q", [0])
+    for note in notes:
+        note_offsets.append(note_offsets[-1] + len(note))
+    extras = {}
+    for match_id, extra in table.extras.items():
+        values = {key: value for key, value in extra.items() if value is not _MISSING}
+        missing = [key for key, value in extra.items() if value is _MISSING]
+        extras[str(match_id)] = {"values": values, "missing": missing} if missing else {"values": values}
+    sections = []
+    for column in (name_offsets, b"".join(names), table.ids, table.teams, table.results, table.fingerprints,
+                   note_offsets, b"".join(notes)):
+        if isinstance(column, array) and sys.byteorder != "little":
+            column = array(column.typecode, column)
+            column.byteswap()
+        sections.append(column.tobytes() if isinstance(column, array) else column)
+    sections.append(json.dumps(extras, ensure_ascii=False).encode("utf-8") if extras else b"")
+    offsets = [MATCH_ARCHIVE_HEADER.size]
+    for section in sections:
+        offsets.append(offsets[-1] + len(section))
+    header = MATCH_ARCHIVE_HEADER.pack(MATCH_ARCHIVE_MAGIC, MATCH_ARCHIVE_VERSION, 0, len(table), len(names),
+                                       *offsets)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(table)
+
+class ArchiveMatchBackend(MatchJournalBackend):
+    # 快照存成二进制归档，增删改照旧追加到日志；启动时按列解码，不必解析 JSON
+    def read_snapshot(self):
+        try:
+            with MatchArchiveReader(self.path) as reader:
+                return reader.records()
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print(f"读取战绩归档失败: {e}")
+            return []
+
+    def load_table(self, registry):
+        # 日志为空时（压缩后的常态）顺带把归档各列直接搬成内存表，MatchStore 就不必逐条重新打包；
+        # 记录和表共用读取器解码好的备注与槽位列，整个归档只解码一遍
+        table = None
+        try:
+            with MatchArchiveReader(self.path) as reader:
+                matches = reader.records()
+                table = CompactMatchTable.from_archive(registry, reader)
+        except FileNotFoundError:
+            matches = []
+        except (OSError, ValueError) as e:
+            print(f"读取战绩归档失败: {e}")
+            matches = []
+        self.pending_ops = self.replay_journal(matches)
+        if self.pending_ops:
+            table = None
+            if self.pending_ops >= self.COMPACT_THRESHOLD:
+                self.write_snapshot(matches)
+        return matches, table
+
+    def write_snapshot(self, matches):
+        write_match_archive(self.path, matches)
+        with open(self.journal_path, "wb"):
+            pass
+        self.pending_ops = 0
+
+def migrate_json_to_archive():
+    # 首次启用归档模式时把现有 matches.json（含未合并的日志）写成归档
+    if os.path.exists(MATCH_ARCHIVE_FILE):
+        return
+    matches = JsonMatchBackend(MATCH_FILE, MATCH_JOURNAL_FILE).load()
+    backfill_match_ids(matches)
+    write_match_archive(MATCH_ARCHIVE_FILE, matches)
+    print(f"已把 {len(matches)} 条战绩写入 {MATCH_ARCHIVE_FILE}")
+
+def convert_match_archive(src, dst):
+    # .nka 与 .json 互转；两个方向都不丢字段
+    if src.endswith(".nka"):
+        with MatchArchiveReader(src) as reader:
+            matches = reader.records()
+        write_json_atomic(dst, matches)
+    else:
+        with open(src, "r", encoding="utf-8") as f:
+            matches = json.load(f)
+        if not isinstance(matches, list) or not all(isinstance(match, dict) for match in matches):
+            raise ValueError("文件格式错误，必须是战绩列表")
+        # 归档以 id 定位记录；缺 id 的旧数据按应用加载时同样的规则补上
+        backfill_match_ids(matches)
+        write_match_archive(dst, matches)
+    return len(matches)
+
+class MatchLoadCancelled(Exception):
+    pass
+
+class MatchLoadJob:
+    # 在后台线程读取战绩、建紧凑表和各索引（纯 Python，不碰 Qt 对象），界面用 QTimer 轮询；
+    # 表一建好就放在 table 上供界面先显示，全部完成后由主线程调用 match_store.poll_loading 装入
+    def __init__(self, store):
+        self.store = store
+        self.table = None
+        self.snapshot = None
+        self.error = None
+        self.stage = "读取战绩"
+        self.holders = 0
+        # 需要在主线程取的签名（见 SqliteMatchBackend），其余后端在读完后于后台线程取
+        self.signature = (store.backend.signature()
+                          if getattr(store.backend, "SIGNATURE_ON_MAIN_THREAD", False) else None)
+        self.aborted = False
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="match-loader")
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.snapshot = self.store._build_snapshot(NameTable(), self)
+        except MatchLoadCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
+    def advance(self, stage):
+        with self._lock:
+            if self._cancel.is_set():
+                self.aborted = True
+                raise MatchLoadCancelled()
+            self.stage = stage
+
+    def attach(self):
+        self.holders += 1
+
+    def detach(self):
+        # 最后一个使用者（窗口）关闭时取消，剩余阶段不再执行
+        self.holders -= 1
+        if self.holders <= 0:
+            self.cancel()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def resume(self):
+        # 撤销取消，让窗口重新打开时接着用这个任务；线程已经放弃（或即将退出）时返回 False
+        with self._lock:
+            if self.aborted:
+                return False
+            self._cancel.clear()
+            return True
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def wait(self):
+        self._thread.join()
+
+class MatchStore:
+    # 进程内共享的战绩表，每条战绩带稳定的整数 id，并维护 id -> 位置 的索引；读写交给存储后端
+    # 监听者（倒排索引等）通过 reset/added/updated/deleted 增量同步
+    def __init__(self, backend, registry):
+        self.backend = backend
+        self.registry = registry
+        self._signature = None
+        self._matches = CompactMatchTable(registry)
+        self._next_id = 1
+        self._version = 0
+        self._load_job = None
+        self._checked_at = 0.0
+        self.index, self.notes_index, self.defense_outcomes, self.statistics = self._create_indexes()
+        self._listeners = [self.index, self.notes_index, self.defense_outcomes, self.statistics]
+
+    @staticmethod
+    def _create_indexes():
+        return [MatchIndex(), NotesNgramIndex(NOTES_INDEX_FILE), DefenseOutcomeIndex(), MatchStatistics(MATCH_STATS_FILE)]
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        if self._signature is not None:
+            listener.reset(self._matches)
+
+    def _build_snapshot(self, registry, job=None):
+        # 读取并建好紧凑表和一套新的内置索引，不改动 self；后台线程和同步加载共用
+        if hasattr(self.backend, "load_table"):
+            matches, table = self.backend.load_table(registry)
+        else:
+            matches, table = self.backend.load(), None
+        backfilled, next_id = backfill_match_ids(matches)
+        backfilled = backfill_team_fingerprints(matches) or backfilled
+        if table is None or backfilled:
+            table = CompactMatchTable(registry, matches)
+        signature = job.signature if job is not None and job.signature is not None else self.backend.signature()
+        indexes = self._create_indexes()
+        if job is not None:
+            job.table = table
+        # 索引直接用刚解析出的字典建，比逐条走视图快；之后这批字典即可释放
+        for position, index in enumerate(indexes, 1):
+            if job is not None:
+                job.advance(f"建立索引 {position}/{len(indexes)}")
+            index.reset(matches)
+        return {"matches": matches, "table": table, "next_id": next_id, "backfilled": backfilled,
+                "signature": signature, "indexes": indexes}
+
+    def _install(self, snapshot):
+        table = snapshot["table"]
+        if table.registry is not self.registry:
+            table.rebind(self.registry)
+        self._matches = table
+        self._next_id = snapshot["next_id"]
+        self._version += 1
+        extra_listeners = self._listeners[4:]
+        self.index, self.notes_index, self.defense_outcomes, self.statistics = snapshot["indexes"]
+        self._listeners = snapshot["indexes"] + extra_listeners
+        self._signature = snapshot["signature"]
+        if snapshot["backfilled"]:
+            self.save()
+        for listener in extra_listeners:
+            listener.reset(snapshot["matches"])
+
+    def _ensure_loaded(self):
+        if self._load_job is not None:
+            # 后台加载进行中时等它结束再装入，避免两边同时读写存储文件
+            self._finish_loading()
+        # 与 CharacterRegistry 相同：签名最多每 SIGNATURE_CHECK_INTERVAL 秒复查一次
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < SIGNATURE_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._signature is not None and self.backend.signature() == self._signature:
+            return
+        self._install(self._build_snapshot(self.registry))
+
+    def load_in_background(self):
+        # 尚未加载（或文件已在外部变化）时启动后台加载并返回任务；已是最新则返回 None
+        # 同一时间只允许一个加载线程：被取消但还在跑的任务直接恢复；已放弃的先等线程退出再开新的
+        job = self._load_job
+        if job is not None:
+            if not job.cancelled() or job.resume():
+                return job
+            self._finish_loading()
+        if self._signature is not None and self.backend.signature() == self._signature:
+            return None
+        job = self._load_job = MatchLoadJob(self)
+        job.start()
+        return job
+
+    def poll_loading(self):
+        # 界面定时调用：后台任务结束后在主线程装入结果；返回 True 表示不再有进行中的加载
+        job = self._load_job
+        if job is None:
+            return True
+        if not job.done():
+            return False
+        self._finish_loading()
+        return True
+
+    def _finish_loading(self):
+        job = self._load_job
+        job.wait()
+        self._load_job = None
+        if job.snapshot is not None and not job.cancelled():
+            self._install(job.snapshot)
+        elif job.error is not None:
+            print(f"后台加载战绩失败: {job.error}")
+
+    def cancel_loading(self):
+        if self._load_job is not None:
+            self._load_job.cancel()
+
+    def invalidate(self):
+        self._signature = None
+
+    def version(self):
+        # 每次重新加载或增删改后递增，供搜索结果缓存判断是否过期
+        self._ensure_loaded()
+        return self._version
+
+    def matches(self):
+        self._ensure_loaded()
+        return list(self._matches)
+
+    def ids(self):
+        self._ensure_loaded()
+        return list(self._matches.ids)
+
+    def get(self, match_id):
+        self._ensure_loaded()
+        return self._matches.view(match_id)
+
+    def position(self, match_id):
+        self._ensure_loaded()
+        return self._matches.positions.get(match_id)
+
+    def in_store_order(self, match_ids):
+        # 按在战绩表中的位置排序；只检查一次加载状态，不要对大量 id 逐个调用 position
+        self._ensure_loaded()
+        return sorted(match_ids, key=self._matches.positions.__getitem__)
+
+    def latest(self, count):
+        # 返回字典副本：调用方（最近战绩预览）会跨修改保留它们，视图在编辑/删除后会变或失效
+        self._ensure_loaded()
+        return [dict(match) for match in self._matches[-count:]] if count else []
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._matches)
+
+    def _new_record(self, match):
+        record = {key: value for key, value in match.items() if key != "id"}
+        record["id"] = self._next_id
+        self._next_id += 1
+        stamp_team_fingerprints(record)
+        return record
+
+    def add(self, match):
+        return self.extend([match])[0]
+
+    def extend(self, matches):
+        self._ensure_loaded()
+        records = [self._new_record(match) for match in matches]
+        self._matches.extend(records)
+        self._version += 1
+        self._commit([{"op": "add", "match": record} for record in records])
+        for listener in self._listeners:
+            listener.added(records)
+        return records
+
+    def update(self, match_id, match):
+        self._ensure_loaded()
+        pos = self._matches.positions.get(match_id)
+        if pos is None:
+            raise KeyError(f"战绩 {match_id} 不存在")
+        record = {key: value for key, value in match.items() if key != "id"}
+        record["id"] = match_id
+        stamp_team_fingerprints(record)
+        old = self._matches.record(pos)
+        self._matches.replace(pos, record)
+        self._version += 1
+        self._commit([{"op": "update", "match": record}])
+        for listener in self._listeners:
+            listener.updated(old, record)
+        return record
+
+    def delete(self, match_ids):
+        self._ensure_loaded()
+        match_ids = [match_id for match_id in dict.fromkeys(match_ids) if match_id in self._matches.positions]
+        removed = [self._matches.record(self._matches.positions[match_id]) for match_id in match_ids]
+        if match_ids:
+            self._matches.remove(match_ids)
+            self._version += 1
+            self._commit([{"op": "delete", "ids": list(match_ids)}])
+            for listener in self._listeners:
+                listener.deleted(removed)
+        return len(match_ids)
+
+    def _commit(self, ops):
+        # 一次增删改（含批量导入/删除）的全部操作作为一组交给后端，只做一次持久写
+        self.backend.commit(self._matches, ops)
+        self._signature = self.backend.signature()
+
+    def save(self):
+        self.backend.write_snapshot(self._matches)
+        self._signature = self.backend.signature()
+
+    def ids_with_member(self, character, side=None):
+        # side 为 "a"/"d"/None（任一方），返回按 id 升序的倒排表，调用方不要修改
+        self._ensure_loaded()
+        return self.index.ids(character, side)
+
+    def ids_with_notes(self, text):
+        # 先用 bigram 索引取候选，再只对候选做子串校验
+        self._ensure_loaded()
+        text = text.lower()
+        return [match_id for match_id in self.notes_index.candidates(text)
+                if text in (self._matches.field(match_id, "notes") or "").lower()]
+
+    def notes_estimate(self, text):
+        self._ensure_loaded()
+        return self.notes_index.estimate(text)
+
+    def ids_with_result(self, result):
+        # 扫一遍结果列；非标准结果存在 extras 里
+        self._ensure_loaded()
+        code = RESULT_CODES.get(result)
+        if code:
+            match_ids = compress(self._matches.ids, (value == code for value in self._matches.results))
+        else:
+            match_ids = (match_id for match_id, extras in self._matches.extras.items() if extras.get("result") == result)
+        return sorted(match_ids)
+
+    def result_count(self, result):
+        self._ensure_loaded()
+        code = RESULT_CODES.get(result)
+        if code:
+            return self._matches.results.count(code)
+        return sum(extras.get("result") == result for extras in self._matches.extras.values())
+
+    def filter_ids(self, match_ids, key, predicate):
+        # 逐条取字段检查，只应在已经缩小的候选上调用；缺失的字段按 None 处理
+        self._ensure_loaded()
+        field = self._matches.field
+
+        def value(match_id):
+            try:
+                return field(match_id, key)
+            except KeyError:
+                return None
+
+        return [match_id for match_id in match_ids if predicate(value(match_id))]
+
+    def group_by_defense(self, match_ids):
+        # 按防守指纹哈希聚合：每组统计场次、胜场和各进攻阵容（按进攻指纹）的战绩，
+        # 最佳进攻取胜率 Wilson 下界最高者；分组按场次降序。
+        # 直接读位置、结果和指纹列；attacks 的值为 [胜, 场次, 代表战绩 id]，队伍只为每组防守和最佳进攻各取一次
+        self._ensure_loaded()
+        table = self._matches
+        positions = table.positions
+        results = table.results
+        fingerprints = table.fingerprints
+        win = RESULT_CODES["胜"]
+
+        def fingerprint(match_id, index, key):
+            # 列里为 0 表示指纹不是标准格式，原值存在 extras 里
+            return fingerprints[index] or table.extras.get(match_id, {}).get(key)
+
+        def team(match_id, key):
+            try:
+                return table.field(match_id, key)
+            except KeyError:
+                return []
+
+        groups = {}
+        # 每组要建好几个字典和列表，组数可与战绩条数同量级
+        with gc_paused():
+            for match_id in match_ids:
+                pos = positions[match_id]
+                defense_fp = fingerprint(match_id, pos * 2 + 1, "team_b_fp")
+                group = groups.get(defense_fp)
+                if group is None:
+                    group = groups[defense_fp] = {"team_b": team(match_id, "team_b"), "ids": [], "wins": 0,
+                                                  "attacks": {}}
+                # 非标准结果存在 extras 里，结果列为 0，不会被当成胜
+                won = results[pos] == win
+                group["ids"].append(match_id)
+                group["wins"] += won
+                attack_fp = fingerprint(match_id, pos * 2, "team_a_fp")
+                attack = group["attacks"].get(attack_fp)
+                if attack is None:
+                    attack = group["attacks"][attack_fp] = [0, 0, match_id]
+                attack[0] += won
+                attack[1] += 1
+            for group in groups.values():
+                best = max(group["attacks"].values(),
+                           key=lambda attack: (wilson_lower_bound(attack[0], attack[1]), attack[1]))
+                group["best_attack"] = (best[0], best[1], team(best[2], "team_a"))
+        return sorted(groups.values(), key=lambda group: (-len(group["ids"]), -group["ids"][-1]))
+
+    def defense_attacks(self, defense):
+        self._ensure_loaded()
+        return self.defense_outcomes.attacks(defense)
+
+    def recommend_attacks(self, defense, top_k=10, min_similarity=0.4):
+        self._ensure_loaded()
+        return self.defense_outcomes.recommend(defense, top_k, min_similarity)
+
+    def match_statistics(self):
+        self._ensure_loaded()
+        return self.statistics
+
+    def verify_statistics(self):
+        self._ensure_loaded()
+        return self.statistics.verify(self._matches)
+
+    def flush_indexes(self):
+        if self._signature is not None:
+            self.notes_index.flush(self._matches)
+            self.statistics.flush(self._matches)
+
+    def compact(self):
+        if self._signature is None:
+            return
+        self.backend.compact(self._matches)
+        self._signature = self.backend.signature()
+
+_character_backend, _match_backend = create_storage_backends(load_settings().get("match_storage", "json"))
+character_registry = CharacterRegistry(_character_backend)
+match_store = MatchStore(_match_backend, character_registry)
+
+def configure_storage(mode):
+    character_registry.flush_order()
+    character_registry.backend, match_store.backend = create_storage_backends(mode)
+    character_registry.invalidate()
+    match_store.invalidate()
+
+class RLStatsEngine:
+    # 全体角色的 RL 值按行存成连续的 N×5 double 数组（行主序），另有 name -> 行号索引；
+    # 队伍合计即按行号取出再逐列求和。角色表版本变化时整体重建
+    WIDTH = len(RL_KEYS)
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._version = None
+        self._rows = {}
+        self._values = array("d")
+        self._columns = [array("d") for _ in RL_KEYS]
+
+    def _ensure_built(self):
+        version = self.registry.version()
+        if version == self._version:
+            return
+        rows = {}
+        values = array("d")
+        for char in self.registry.characters():
+            rows[char["name"]] = len(rows)
+            for key in RL_KEYS:
+                try:
+                    values.append(float(char.get(key, 0) or 0))
+                except (TypeError, ValueError):
+                    values.append(0.0)
+        self._rows = rows
+        self._values = values
+        # 按列再存一份，算队伍合计时每列只需一次 gather
+        self._columns = [values[col::self.WIDTH] for col in range(self.WIDTH)]
+        self._version = version
+
+    def __len__(self):
+        self._ensure_built()
+        return len(self._rows)
+
+    def names(self):
+        # 行号 -> 名称
+        self._ensure_built()
+        return list(self._rows)
+
+    def values(self):
+        # 行主序的 N×5 RL 表副本
+        self._ensure_built()
+        return array("d", self._values)
+
+    def row(self, name):
+        self._ensure_built()
+        return self._rows.get(name)
+
+    def rows(self, names):
+        # 不在角色表里的名字直接忽略，与原先逐个查字典的行为一致
+        self._ensure_built()
+        return [self._rows[name] for name in names if name in self._rows]
+
+    def row_values(self, row):
+        self._ensure_built()
+        start = row * self.WIDTH
+        return self._values[start:start + self.WIDTH]
+
+    def team_totals_for_rows(self, rows):
+        self._ensure_built()
+        return [sum(map(column.__getitem__, rows)) for column in self._columns]
+
+    def team_totals(self, names):
+        return self.team_totals_for_rows(self.rows(names))
+
+    @staticmethod
+    def first_burst_tier(totals, threshold=BURST_THRESHOLD):
+        # 返回第一个合计达到阈值的 RL 档位下标，都达不到时返回 None
+        for tier, value in enumerate(totals):
+            if value >= threshold:
+                return tier
+        return None
+
+rl_stats = RLStatsEngine(character_registry)
+
+def format_team_stats(side_label, names):
+    totals = rl_stats.team_totals(names)
+    first_tier = rl_stats.first_burst_tier(totals)
+
+    def format_stat(tier):
+        text = f"{RL_KEYS[tier]}: {totals[tier]:.1f}"
+        if tier == first_tier:
+            return f"<span style='color: red; font-weight: bold;'>{text}</span>"
+        return text
+
+    return f"{side_label}: " + " | ".join(format_stat(tier) for tier in range(len(RL_KEYS)))
+
+CHARACTER_TYPES = ["火力型", "防御型", "辅助型"]
+BURST_RANKS = ["I", "II", "III", "Λ"]
+
+def constraint_gap(type_mins, ranks, type_counts, rank_counts):
+    # 还差多少个位置才能满足类型与爆裂覆盖要求；Λ 可补任意一个缺失的 I/II/III
+    missing_types = sum(max(0, count - type_counts.get(char_type, 0)) for char_type, count in type_mins.items())
+    missing_ranks = sum(1 for rank in ranks if rank != "Λ" and not rank_counts.get(rank))
+    lambda_count = rank_counts.get("Λ", 0)
+    if "Λ" in ranks:
+        if not lambda_count:
+            return max(missing_types, missing_ranks + 1)
+        lambda_count -= 1
+    return max(missing_types, missing_ranks - lambda_count)
+
+class TeamFinder:
+    # 在整个角色表里找满足约束、在尽可能低的 RL 档位达到阈值的 5 人队伍。
+    # 按档位从低到高搜索；每档把候选按该档 RL 降序排列做组合 DFS，
+    # 当前和 + 剩余最优可能和不够阈值（或不如已有第 k 名）时剪枝，且后续候选只会更小，直接回溯。
+    # search() 是生成器，每展开 step 个节点让出一次，调用方可随时读取 results()
+    def __init__(self, engine, registry, required=(), excluded=(), type_mins=None, ranks=(),
+                 top_k=20, threshold=BURST_THRESHOLD):
+        self.engine = engine
+        self.threshold = threshold
+        self.top_k = top_k
+        self.type_mins = {char_type: count for char_type, count in (type_mins or {}).items() if count > 0}
+        self.ranks = set(ranks)
+        if sum(self.type_mins.values()) > TEAM_SIZE:
+            raise ValueError("类型要求超过 5 人")
+        self.required = []
+        for name in required:
+            if name not in registry:
+                raise ValueError(f"角色不存在: {name}")
+            if name not in self.required:
+                self.required.append(name)
+        if len(self.required) > TEAM_SIZE:
+            raise ValueError("必选角色超过 5 人")
+        excluded = set(excluded)
+        if excluded & set(self.required):
+            raise ValueError("同一角色不能既必选又排除")
+        self.attrs = {}
+        for char in registry.characters():
+            self.attrs[char["name"]] = (char.get("type", ""), char.get("rank", ""))
+        self.pool = [name for name in self.attrs if name not in excluded and name not in self.required]
+        self.heap = []
+        self.nodes = 0
+        self.finished = False
+
+    def _missing(self, type_counts, rank_counts):
+        return constraint_gap(self.type_mins, self.ranks, type_counts, rank_counts)
+
+    def _count(self, counts, key, delta):
+        counts[key] = counts.get(key, 0) + delta
+
+    def results(self):
+        # [(首个达标档位, 该档合计, 队伍名称元组)]，按档位升序、合计降序
+        return [(-neg_tier, score, team) for neg_tier, score, team in
+                sorted(self.heap, key=lambda item: (-item[0], -item[1], item[2]))]
+
+    def _offer(self, tier, score, team):
+        item = (-tier, score, team)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def search(self, step=20000):
+        engine = self.engine
+        required_rows = engine.rows(self.required)
+        need = TEAM_SIZE - len(self.required)
+        type_counts = {}
+        rank_counts = {}
+        for name in self.required:
+            char_type, rank = self.attrs[name]
+            self._count(type_counts, char_type, 1)
+            self._count(rank_counts, rank, 1)
+        budget = step
+        for tier in range(len(RL_KEYS)):
+            if len(self.heap) >= self.top_k and -self.heap[0][0] < tier:
+                break
+            base_totals = engine.team_totals_for_rows(required_rows)
+            candidates = sorted(((engine.row_values(engine.row(name))[tier], name) for name in self.pool),
+                                reverse=True)
+            values = [value for value, _ in candidates]
+            names = [name for _, name in candidates]
+            prefix = [0.0]
+            for value in values:
+                prefix.append(prefix[-1] + value)
+            n = len(values)
+            chosen = []
+            sums = [base_totals[tier]]
+            i = 0
+            while True:
+                self.nodes += 1
+                budget -= 1
+                if budget <= 0:
+                    budget = step
+                    yield
+                remaining = need - len(chosen)
+                backtrack = False
+                if remaining == 0:
+                    self._visit_leaf(tier, required_rows, [names[pos] for pos in chosen], sums[-1],
+                                     type_counts, rank_counts)
+                    backtrack = True
+                elif i + remaining > n:
+                    backtrack = True
+                else:
+                    bound = sums[-1] + prefix[i + remaining] - prefix[i]
+                    floor_met = bound >= self.threshold
+                    if floor_met and len(self.heap) >= self.top_k and -self.heap[0][0] == tier:
+                        floor_met = bound > self.heap[0][1]
+                    if not floor_met:
+                        backtrack = True
+                    else:
+                        char_type, rank = self.attrs[names[i]]
+                        self._count(type_counts, char_type, 1)
+                        self._count(rank_counts, rank, 1)
+                        if self._missing(type_counts, rank_counts) > remaining - 1:
+                            self._count(type_counts, char_type, -1)
+                            self._count(rank_counts, rank, -1)
+                            i += 1
+                        else:
+                            chosen.append(i)
+                            sums.append(sums[-1] + values[i])
+                            i += 1
+                if backtrack:
+                    if not chosen:
+                        break
+                    pos = chosen.pop()
+                    sums.pop()
+                    char_type, rank = self.attrs[names[pos]]
+                    self._count(type_counts, char_type, -1)
+                    self._count(rank_counts, rank, -1)
+                    i = pos + 1
+        self.finished = True
+
+    def _visit_leaf(self, tier, required_rows, members, score, type_counts, rank_counts):
+        if score < self.threshold or self._missing(type_counts, rank_counts) > 0:
+            return
+        team = tuple(self.required + members)
+        if tier:
+            # 低档位已达标的队伍在更低档位已经统计过
+            totals = self.engine.team_totals_for_rows(required_rows + self.engine.rows(members))
+            if self.engine.first_burst_tier(totals[:tier], self.threshold) is not None:
+                return
+        self._offer(tier, score, team)
+
+    def run(self):
+        for _ in self.search():
+            pass
+        return self.results()
+
+def defense_win_rates(defense):
+    # 历史上对阵这套防守（成员集合完全一致）时，每个进攻角色的 (胜场, 出场)
+    rates = {}
+    for wins, attempts, names in match_store.defense_attacks(defense).values():
+        for name in names:
+            total_wins, total_attempts = rates.get(name, (0, 0))
+            rates[name] = (total_wins + wins, total_attempts + attempts)
+    return rates
+
+_enumeration_state = {}
+
+class EnumerationCancelled(Exception):
+    pass
+
+def _enumeration_worker_init(shm_name, row_count, settings, cancel_event):
+    # 子进程只在启动时挂一次共享内存里的 RL 表（N×5 RL + N 个胜率权重），任务本身只传首位下标
+    shm = shared_memory.SharedMemory(name=shm_name)
+    table = shm.buf.cast("d")
+    width = RLStatsEngine.WIDTH
+    pool = settings["pool"]
+    _enumeration_state.update(settings)
+    _enumeration_state["shm"] = shm
+    _enumeration_state["cancel_event"] = cancel_event
+    _enumeration_state["values"] = [[table[row * width + tier] for tier in range(width)] for row in pool]
+    _enumeration_state["weights"] = [table[row_count * width + row] for row in pool]
+    _enumeration_state["required_totals"] = [sum(table[row * width + tier] for row in settings["required"])
+                                             for tier in range(width)]
+    _enumeration_state["required_weight"] = sum(table[row_count * width + row] for row in settings["required"])
+    # suffix_best[col][j][r]: pool[j:] 中第 col 列（各档 RL，最后一列为胜率权重）最大的 r 个值之和，作剪枝上界
+    columns = [[row_values[tier] for row_values in _enumeration_state["values"]] for tier in range(width)]
+    columns.append(_enumeration_state["weights"])
+    suffix_best = []
+    for column in columns:
+        best = [[0.0] * TEAM_SIZE for _ in range(len(pool) + 1)]
+        top = []
+        for j in range(len(pool) - 1, -1, -1):
+            top = sorted(top + [column[j]], reverse=True)[:TEAM_SIZE - 1]
+            for r in range(1, TEAM_SIZE):
+                best[j][r] = sum(top[:r])
+        suffix_best.append(best)
+    _enumeration_state["suffix_best"] = suffix_best
+    # 本进程目前见过的前 k 名（跨任务累积），只用来收紧剪枝界
+    _enumeration_state["floor"] = []
+
+def _enumerate_leading(lead):
+    # 枚举以 pool[lead] 为首位（其余成员下标更大）的全部队伍，返回本任务的前 k 名与展开节点数
+    state = _enumeration_state
+    values = state["values"]
+    weights = state["weights"]
+    attrs = state["attrs"]
+    suffix_best = state["suffix_best"]
+    weight_best = suffix_best[-1]
+    floor = state["floor"]
+    type_mins = state["type_mins"]
+    ranks = state["ranks"]
+    threshold = state["threshold"]
+    top_k = state["top_k"]
+    need = state["need"]
+    cancel_event = state["cancel_event"]
+    width = RLStatsEngine.WIDTH
+    n = len(values)
+    heap = []
+    nodes = 0
+    type_counts = dict(state["type_counts"])
+    rank_counts = dict(state["rank_counts"])
+
+    def push(pos):
+        char_type, rank = attrs[pos]
+        type_counts[char_type] = type_counts.get(char_type, 0) + 1
+        rank_counts[rank] = rank_counts.get(rank, 0) + 1
+
+    def pop(pos):
+        char_type, rank = attrs[pos]
+        type_counts[char_type] -= 1
+        rank_counts[rank] -= 1
+
+    def visit(start, chosen, totals, weight):
+        nonlocal nodes
+        nodes += 1
+        if nodes % 4096 == 0 and cancel_event.is_set():
+            raise EnumerationCancelled
+        remaining = need - len(chosen)
+        if remaining == 0:
+            tier = RLStatsEngine.first_burst_tier(totals, threshold)
+            if tier is None or constraint_gap(type_mins, ranks, type_counts, rank_counts) > 0:
+                return
+            item = (-tier, weight, totals[tier], tuple(chosen))
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            if len(floor) < top_k:
+                heapq.heappush(floor, item[:3])
+            elif item[:3] > floor[0]:
+                heapq.heapreplace(floor, item[:3])
+            return
+        for pos in range(start, n - remaining + 1):
+            row_values = values[pos]
+            # 已有 k 名时，比第 k 名档位更高的不必再看；同档则要求 (胜率, 合计) 上界更好
+            worst = floor[0] if len(floor) >= top_k else None
+            last_tier = -worst[0] if worst else width - 1
+            reachable = False
+            for tier in range(last_tier + 1):
+                score_bound = totals[tier] + row_values[tier] + suffix_best[tier][pos + 1][remaining - 1]
+                if score_bound < threshold:
+                    continue
+                if worst and tier == last_tier:
+                    weight_bound = weight + weights[pos] + weight_best[pos + 1][remaining - 1]
+                    if (weight_bound, score_bound) <= worst[1:]:
+                        continue
+                reachable = True
+                break
+            if not reachable:
+                continue
+            push(pos)
+            if constraint_gap(type_mins, ranks, type_counts, rank_counts) <= remaining - 1:
+                chosen.append(pos)
+                visit(pos + 1, chosen,
+                      [totals[tier] + row_values[tier] for tier in range(width)], weight + weights[pos])
+                chosen.pop()
+            pop(pos)
+
+    try:
+        if lead is None:
+            visit(0, [], state["required_totals"], state["required_weight"])
+        else:
+            push(lead)
+            if constraint_gap(type_mins, ranks, type_counts, rank_counts) <= need - 1:
+                visit(lead + 1, [lead], [state["required_totals"][tier] + values[lead][tier] for tier in range(width)],
+                      state["required_weight"] + weights[lead])
+    except EnumerationCancelled:
+        return [], nodes, False
+    return heap, nodes, True
+
+class TeamEnumerationJob:
+    # 多进程穷举：按首位成员把组合空间切成任务交给 ProcessPoolExecutor，
+    # RL 表经 shared_memory 只传一次；主进程合并各任务的前 k 名。
+    # GUI 用 QTimer 定时调用 poll()，命令行用 wait()；cancel() 让子进程尽快返回
+    def __init__(self, engine, registry, required=(), excluded=(), type_mins=None, ranks=(), top_k=20,
+                 defense=(), threshold=BURST_THRESHOLD, workers=None):
+        # 约束校验和候选池与单线程配队搜索共用
+        finder = TeamFinder(engine, registry, required, excluded, type_mins, ranks, top_k, threshold)
+        self.engine = engine
+        self.finder = finder
+        self.top_k = top_k
+        self.threshold = threshold
+        self.workers = workers
+        self.rates = defense_win_rates(defense)
+        self.heap = []
+        self.nodes = 0
+        self.done = 0
+        self.total = 0
+        self.cancelled = False
+        self.futures = []
+        self.executor = None
+        self.shm = None
+        self.cancel_event = None
+
+    def start(self):
+        engine = self.engine
+        engine._ensure_built()
+        names = engine.names()
+        row_count = len(names)
+        width = RLStatsEngine.WIDTH
+        weights = array("d", [0.0] * row_count)
+        for name, (wins, attempts) in self.rates.items():
+            row = engine.row(name)
+            if row is not None and attempts:
+                weights[row] = wins / attempts
+        table = engine.values() + weights
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, len(table) * table.itemsize))
+        self.shm.buf[:len(table) * table.itemsize] = table.tobytes()
+
+        finder = self.finder
+        pool = engine.rows(finder.pool)
+        self.pool_names = [names[row] for row in pool]
+        type_counts = {}
+        rank_counts = {}
+        for name in finder.required:
+            char_type, rank = finder.attrs[name]
+            type_counts[char_type] = type_counts.get(char_type, 0) + 1
+            rank_counts[rank] = rank_counts.get(rank, 0) + 1
+        need = TEAM_SIZE - len(finder.required)
+        settings = {
+            "pool": pool,
+            "required": engine.rows(finder.required),
+            "attrs": [finder.attrs[name] for name in self.pool_names],
+            "type_mins": finder.type_mins,
+            "ranks": finder.ranks,
+            "type_counts": type_counts,
+            "rank_counts": rank_counts,
+            "threshold": self.threshold,
+            "top_k": self.top_k,
+            "need": need,
+        }
+        # 统一用 spawn：不在已启动 Qt 的进程里 fork，各平台行为也与 Windows 一致
+        context = multiprocessing.get_context("spawn")
+        self.cancel_event = context.Event()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                            initializer=_enumeration_worker_init,
+                                            initargs=(self.shm.name, row_count, settings, self.cancel_event))
+        # 首位越靠前子树越大，按顺序提交正好先发大任务
+        leads = [None] if need == 0 else range(len(pool) - need + 1)
+        self.futures = [self.executor.submit(_enumerate_leading, lead) for lead in leads]
+        self.total = len(self.futures)
+
+    def _collect(self, future):
+        self.done += 1
+        try:
+            heap, nodes, completed = future.result()
+        except Exception as e:
+            print(f"穷举任务失败: {e}")
+            return
+        self.nodes += nodes
+        for neg_tier, weight, score, positions in heap:
+            team = tuple(self.finder.required + [self.pool_names[pos] for pos in positions])
+            item = (neg_tier, weight, score, team)
+            if len(self.heap) < self.top_k:
+                heapq.heappush(self.heap, item)
+            elif item > self.heap[0]:
+                heapq.heapreplace(self.heap, item)
+
+    def poll(self):
+        # 收集已完成的任务，全部完成（或已取消）时释放进程池并返回 True
+        pending = []
+        for future in self.futures:
+            if future.done():
+                if not future.cancelled():
+                    self._collect(future)
+            else:
+                pending.append(future)
+        self.futures = pending
+        if pending and not self.cancelled:
+            return False
+        self.close()
+        return True
+
+    def wait(self, progress=None):
+        try:
+            for future in as_completed(self.futures):
+                self._collect(future)
+                if progress:
+                    progress(self.done, self.total)
+        finally:
+            self.futures = []
+            self.close()
+        return self.results()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        for future in self.futures:
+            future.cancel()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def results(self):
+        # [(首个达标档位, 该档合计, 对阵该防守的历史胜率之和, 队伍名称元组)]
+        return [(-neg_tier, score, weight, team) for neg_tier, weight, score, team in
+                sorted(self.heap, key=lambda item: (-item[0], -item[1], -item[2], item[3]))]
+
+def run_enumeration(args):
+    type_mins = {}
+    for spec in args.min_type or []:
+        char_type, _, count = spec.partition("=")
+        type_mins[char_type] = int(count or 1)
+    resolve = character_registry.resolve_name
+    try:
+        job = TeamEnumerationJob(rl_stats, character_registry,
+                                 required=[resolve(name) for name in args.require or []],
+                                 excluded=[resolve(name) for name in args.exclude or []],
+                                 type_mins=type_mins, ranks=args.ranks or [], top_k=args.top_k,
+                                 defense=[resolve(name) for name in args.defense or []], workers=args.workers)
+    except ValueError as e:
+        print(e)
+        return 1
+    job.start()
+
+    def progress(done, total):
+        print(f"\r穷举进度 {done}/{total}", end="", flush=True)
+
+    try:
+        results = job.wait(progress)
+    except KeyboardInterrupt:
+        job.cancel()
+        job.close()
+        print("\n已取消")
+        return 1
+    print(f"\n共展开 {job.nodes} 个节点")
+    for tier, score, weight, team in results:
+        print(f"{RL_KEYS[tier]}: {score:.1f}  胜率和 {weight:.2f}  " + " / ".join(team))
+    return 0
+
+def get_character_image_path(character_name):
+    return character_registry.image_path(character_name)
+
+class ThumbnailStore:
+    # 磁盘上的预缩放头像，按原图内容哈希命名，索引记录原图的 mtime/size 以免每次启动都重新哈希
+    SIZES = [(40, 40, Qt.KeepAspectRatioByExpanding), (60, 60, Qt.KeepAspectRatio)]
+
+    def __init__(self, thumb_dir, index_file):
+        self.thumb_dir = thumb_dir
+        self.index_file = index_file
+        self._dirty = False
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._index = {}
+
+    def handles(self, width, height, aspect_mode):
+        return (width, height, aspect_mode) in self.SIZES
+
+    def _content_hash(self, img_path):
+        st = os.stat(img_path)
+        key = os.path.basename(img_path)
+        entry = self._index.get(key)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            return entry["hash"]
+        with open(img_path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._index[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": digest}
+        self._dirty = True
+        return digest
+
+    def thumbnail_path(self, img_path, width, height, aspect_mode):
+        # 生成不了缩略图（原图读不出、目录不可写等）时返回 None，调用方改用原图
+        try:
+            digest = self._content_hash(img_path)
+        except OSError:
+            return None
+        thumb_path = os.path.join(self.thumb_dir, f"{digest}_{width}x{height}_{int(aspect_mode)}.png")
+        if not os.path.exists(thumb_path):
+            image = QImage(img_path)
+            if image.isNull():
+                return None
+            tmp_path = f"{thumb_path}.tmp"
+            if not image.scaled(width, height, aspect_mode, Qt.SmoothTransformation).save(tmp_path, "PNG"):
+                return None
+            try:
+                os.replace(tmp_path, thumb_path)
+            except OSError:
+                return None
+        return thumb_path
+
+    def generate(self, img_path):
+        for width, height, aspect_mode in self.SIZES:
+            self.thumbnail_path(img_path, width, height, aspect_mode)
+
+    def invalidate(self, img_path):
+        if self._index.pop(os.path.basename(img_path), None) is not None:
+            self._dirty = True
+
+    def flush(self):
+        if not self._dirty:
+            return
+        try:
+            tmp_path = f"{self.index_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+            self._dirty = False
+        except OSError as e:
+            print(f"保存缩略图索引失败: {e}")
+
+    def prune(self):
+        live = {entry["hash"] for entry in self._index.values()}
+        for fname in os.listdir(self.thumb_dir):
+            if fname.endswith(".png") and fname.split("_", 1)[0] not in live:
+                try:
+                    os.remove(os.path.join(self.thumb_dir, fname))
+                except OSError:
+                    pass
+
+thumbnail_store = ThumbnailStore(THUMB_DIR, THUMB_INDEX_FILE)
+
+class ThumbnailWarmup:
+    # 在事件循环空闲时分批预生成缩略图，冷启动时界面只需解码小图
+    def __init__(self, img_paths, batch_size=4, prune=False):
+        self.pending = list(img_paths)
+        self.batch_size = batch_size
+        self.prune = prune
+        QTimer.singleShot(0, self.step)
+
+    def step(self):
+        for img_path in self.pending[:self.batch_size]:
+            try:
+                thumbnail_store.generate(img_path)
+            except Exception as e:
+                print(f"生成缩略图失败 {img_path}: {e}")
+        del self.pending[:self.batch_size]
+        if self.pending:
+            QTimer.singleShot(0, self.step)
+            return
+        thumbnail_store.flush()
+        if self.prune:
+            thumbnail_store.prune()
+
+class PortraitCache:
+    # 缩放后头像的 LRU 缓存，键为 (图片路径, 宽, 高, 缩放模式)，按字节预算淘汰
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, img_path, width, height, aspect_mode=Qt.KeepAspectRatio):
+        key = (img_path, width, height, int(aspect_mode))
+        pixmap = self._entries.get(key)
+        if pixmap is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return pixmap
+        self.misses += 1
+        source_path = None
+        if thumbnail_store.handles(width, height, aspect_mode):
+            source_path = thumbnail_store.thumbnail_path(img_path, width, height, aspect_mode)
+        pixmap = QPixmap(source_path or img_path)
+        if pixmap.isNull():
+            return pixmap
+        pixmap = pixmap.scaled(width, height, aspect_mode, Qt.SmoothTransformation)
+        self._entries[key] = pixmap
+        self._bytes += self._pixmap_bytes(pixmap)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._pixmap_bytes(evicted)
+            self.evictions += 1
+        return pixmap
+
+    def invalidate(self, img_path):
+        for key in [key for key in self._entries if key[0] == img_path]:
+            self._bytes -= self._pixmap_bytes(self._entries.pop(key))
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        # 命中/未命中计数和占用，显示在战绩统计窗口底部
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+portrait_cache = PortraitCache()
+
+def invalidate_portrait(img_path):
+    portrait_cache.invalidate(img_path)
+    thumbnail_store.invalidate(img_path)
+    if _roster_model is not None:
+        _roster_model.invalidate_image(img_path)
+    if os.path.exists(img_path):
+        ThumbnailWarmup([img_path])
+
+def get_character_pixmap(character_name, width, height, aspect_mode=Qt.KeepAspectRatio):
+    img_path = get_character_image_path(character_name)
+    if not img_path:
+        return None
+    pixmap = portrait_cache.get(img_path, width, height, aspect_mode)
+    return None if pixmap.isNull() else pixmap
+
+CHARACTER_TYPE_ROLE = Qt.UserRole + 1
+CHARACTER_RANK_ROLE = Qt.UserRole + 2
+
+def character_tooltip(char):
+    return (
+        f"<p style='font-family: Arial; font-size: 12px;'>"
+        f"<table>"
+        f"<tr><td style='width: 80px;'>名称:</td><td>{char.get('name', '')}</td></tr>"
+        f"<tr><td style='width: 80px;'>昵称:</td><td>{char.get('nickname', '') or 'none'}</td></tr>"
+        f"<tr><td style='width: 80px;'>类型:</td><td>{char.get('type', '') or '未设置'}</td></tr>"
+        f"<tr><td style='width: 80px;'>等级:</td><td>{char.get('rank', '') or '未设置'}</td></tr>"
+        f"<tr><td style='width: 80px;'>2RL:</td><td>{char.get('2RL', 0):.1f}</td></tr>"
+        f"<tr><td style='width: 80px;'>2.5RL:</td><td>{char.get('2.5RL', 0):.1f}</td></tr>"
+        f"<tr><td style='width: 80px;'>3RL:</td><td>{char.get('3RL', 0):.1f}</td></tr>"
+        f"<tr><td style='width: 80px;'>3.5RL:</td><td>{char.get('3.5RL', 0):.1f}</td></tr>"
+        f"<tr><td style='width: 80px;'>4RL:</td><td>{char.get('4RL', 0):.1f}</td></tr>"
+        f"</table>"
+        f"</p>"
+    )
+
+class RosterModel(QAbstractListModel):
+    # 各窗口角色面板共用的列表模型：每个角色的图标和省略后的名字只生成一次，提示框 HTML 第一次悬停时才生成；
+    # 角色表版本变化时按名字复用没改动的条目。筛选交给各窗口自己的 RosterFilterProxy
+    ICON_SIZE = 60
+    ITEM_SIZE = QSize(60, 80)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._items = []
+        self._version = None
+        self._font_metrics = None
+
+    def refresh(self):
+        version = character_registry.version()
+        if version == self._version:
+            return
+        self._version = version
+        cached = {item["char"]["name"]: item for item in self._items}
+        items = []
+        for char in character_registry.characters():
+            img_path = character_registry.image_path(char["name"])
+            item = cached.get(char["name"])
+            if item is None or item["char"] != char or item["image_path"] != img_path:
+                item = {"char": char, "image_path": img_path, "icon": None, "text": None, "tooltip": None}
+            items.append(item)
+        if len(items) == len(self._items) and all(new is old for new, old in zip(items, self._items)):
+            # 只是本程序刚保存过（例如拖动排序后），内容和顺序都没变
+            return
+        self.beginResetModel()
+        self._items = items
+        self.endResetModel()
+
+    def character(self, row):
+        return self._items[row]["char"]
+
+    def names(self):
+        return [item["char"]["name"] for item in self._items]
+
+    def move_row(self, source, target):
+        # 把第 source 行移到 target（移动后的下标），与 QListWidget 先 takeItem 再 insertItem 的结果一致
+        if source == target:
+            return
+        if not self.beginMoveRows(QModelIndex(), source, source, QModelIndex(),
+                                  target + 1 if target > source else target):
+            return
+        self._items.insert(target, self._items.pop(source))
+        self.endMoveRows()
+
+    def invalidate_image(self, img_path):
+        for row, item in enumerate(self._items):
+            if item["icon"] is not None and item["image_path"] == img_path:
+                item["icon"] = None
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._items)
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._items):
+            return None
+        item = self._items[index.row()]
+        char = item["char"]
+        if role == Qt.UserRole:
+            return char["name"]
+        if role == Qt.DisplayRole:
+            if item["text"] is None:
+                if self._font_metrics is None:
+                    self._font_metrics = QFontMetrics(QApplication.font())
+                item["text"] = self._font_metrics.elidedText(char["name"], Qt.ElideRight, self.ICON_SIZE)
+            return item["text"]
+        if role == Qt.DecorationRole:
+            if item["icon"] is None:
+                img_path = item["image_path"]
+                item["icon"] = QIcon(portrait_cache.get(img_path, self.ICON_SIZE, self.ICON_SIZE)) if img_path else QIcon()
+            return item["icon"]
+        if role == Qt.ToolTipRole:
+            if item["tooltip"] is None:
+                item["tooltip"] = character_tooltip(char)
+            return item["tooltip"]
+        if role == CHARACTER_TYPE_ROLE:
+            return char.get("type", "")
+        if role == CHARACTER_RANK_ROLE:
+            return char.get("rank", "")
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignHCenter
+        if role == Qt.SizeHintRole:
+            return self.ITEM_SIZE
+        return None
+
+_roster_model = None
+
+def shared_roster_model():
+    # 需要 QApplication 之后才能创建，第一次使用时再建
+    global _roster_model
+    if _roster_model is None:
+        _roster_model = RosterModel()
+    return _roster_model
+
+class RosterFilterProxy(QSortFilterProxyModel):
+    ALL_TYPES = "所有类型"
+    ALL_RANKS = "所有爆裂"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.char_type = self.ALL_TYPES
+        self.rank = self.ALL_RANKS
+
+    def set_filters(self, char_type, rank):
+        if (char_type, rank) == (self.char_type, self.rank):
+            return
+        self.char_type = char_type
+        self.rank = rank
+        self.invalidateFilter()
+
+    def is_filtered(self):
+        return self.char_type != self.ALL_TYPES or self.rank != self.ALL_RANKS
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        char = self.sourceModel().character(source_row)
+        return ((self.char_type == self.ALL_TYPES or char.get("type", "") == self.char_type) and
+                (self.rank == self.ALL_RANKS or char.get("rank", "") == self.rank))
+
+class CharacterListView(QListView):
+    # 角色面板，显示共享 RosterModel 经本窗口筛选后的结果；未筛选时可拖动调整角色顺序
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.proxy = RosterFilterProxy(self)
+        self.proxy.setSourceModel(shared_roster_model())
+        self.setModel(self.proxy)
         self.setDragEnabled(True)
         self.setAcceptDrops(True)
         self.setDropIndicatorShown(True)
-        self.setDragDropMode(QListWidget.DragDrop)
+        self.setDragDropMode(QListView.DragDrop)
         self.setDefaultDropAction(Qt.MoveAction)
+        self.setUniformItemSizes(True)
         self.parent_widget = parent
 
-    def startDrag(self, supportedActions):
-        is_filtered = False
-        if self.parent_widget:
-            is_filtered = (self.parent_widget.filter_type_combo.currentText() != "所有类型" or
-                           self.parent_widget.filter_rank_combo.currentText() != "所有爆裂")
+    def set_filters(self, char_type, rank):
+        shared_roster_model().refresh()
+        self.proxy.set_filters(char_type, rank)
 
+    def count(self):
+        return self.proxy.rowCount()
+
+    def selected_names(self):
+        indexes = sorted(self.selectionModel().selectedIndexes(), key=lambda index: index.row())
+        return [index.data(Qt.UserRole) for index in indexes]
+
+    def startDrag(self, supportedActions):
         drag = QDrag(self)
         mimeData = QMimeData()
-        if self.currentItem():
-            real_name = self.currentItem().data(Qt.UserRole)
-            mimeData.setText(real_name)
-            if not is_filtered:
-                mimeData.setData("application/x-character-index", str(self.currentRow()).encode())
+        index = self.currentIndex()
+        if index.isValid():
+            mimeData.setText(index.data(Qt.UserRole))
+            if not self.proxy.is_filtered():
+                mimeData.setData("application/x-character-index", str(index.row()).encode())
         drag.setMimeData(mimeData)
         drag.exec_(Qt.MoveAction | Qt.CopyAction)
 
     def dragEnterEvent(self, event):
-        if event.mimeData().hasFormat("application/x-character-index"):
-            if self.parent_widget:
-                is_filtered = (self.parent_widget.filter_type_combo.currentText() != "所有类型" or
-                               self.parent_widget.filter_rank_combo.currentText() != "所有爆裂")
-                if is_filtered:
-                    event.ignore()
-                    return
+        if event.mimeData().hasFormat("application/x-character-index") and not self.proxy.is_filtered():
             event.acceptProposedAction()
-        elif event.mimeData().hasText():
-            event.ignore()
         else:
             event.ignore()
 
     def dragMoveEvent(self, event):
-        if event.mimeData().hasFormat("application/x-character-index"):
-            if self.parent_widget:
-                is_filtered = (self.parent_widget.filter_type_combo.currentText() != "所有类型" or
-                               self.parent_widget.filter_rank_combo.currentText() != "所有爆裂")
-                if is_filtered:
-                    event.ignore()
-                    return
+        if event.mimeData().hasFormat("application/x-character-index") and not self.proxy.is_filtered():
             event.acceptProposedAction()
-        elif event.mimeData().hasText():
-            event.ignore()
         else:
             event.ignore()
 
     def dropEvent(self, event):
-        if event.mimeData().hasFormat("application/x-character-index"):
-            is_filtered = False
-            if self.parent_widget:
-                is_filtered = (self.parent_widget.filter_type_combo.currentText() != "所有类型" or
-                               self.parent_widget.filter_rank_combo.currentText() != "所有爆裂")
-            if is_filtered:
-                event.ignore()
-                return
-
-            source_index = int(event.mimeData().data("application/x-character-index").data().decode())
-            drop_row = self.indexAt(event.pos()).row()
-            if drop_row == -1:
-                drop_row = self.count()
-            if source_index != drop_row and source_index != drop_row - 1:
-                item = self.takeItem(source_index)
-                self.insertItem(drop_row, item)
-                self.setCurrentItem(item)
-                if self.parent_widget:
-                    self.parent_widget.update_character_order()
-            event.acceptProposedAction()
-        else:
+        if not event.mimeData().hasFormat("application/x-character-index") or self.proxy.is_filtered():
             event.ignore()
+            return
+        source_index = int(event.mimeData().data("application/x-character-index").data().decode())
+        drop_row = self.indexAt(event.pos()).row()
+        if drop_row == -1:
+            drop_row = self.count()
+        if source_index != drop_row and source_index != drop_row - 1:
+            target = min(drop_row, self.count() - 1)
+            shared_roster_model().move_row(source_index, target)
+            self.setCurrentIndex(self.proxy.index(target, 0))
+            if self.parent_widget:
+                self.parent_widget.update_character_order()
+        event.acceptProposedAction()
 
 class DropLabel(QLabel):
     def __init__(self, parent=None):
@@ -179,21 +3071,22 @@ class DropLabel(QLabel):
 
     def dropEvent(self, event):
         if event.mimeData().hasText():
-            char_name = event.mimeData().text()
-            self.character_name = char_name
-            img_path = get_character_image_path(char_name)
-            if img_path:
-                pixmap = QPixmap(img_path).scaled(60, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.setPixmap(pixmap)
-                self.setStyleSheet("border: none;")
-            else:
-                self.setText(char_name)
+            self.set_character(event.mimeData().text())
             if self.parent_widget and hasattr(self.parent_widget, 'update_team_stats'):
                 self.parent_widget.update_team_stats()
             event.accept()
         else:
             event.accept()
 
+    def set_character(self, char_name):
+        self.character_name = char_name
+        pixmap = get_character_pixmap(char_name, 60, 60)
+        if pixmap:
+            self.setPixmap(pixmap)
+            self.setStyleSheet("border: none;")
+        else:
+            self.setText(char_name)
+
     def clear_label(self):
         self.clear()
         self.setStyleSheet("border: 2px dashed #aaa; background-color: #f8f8f8;")
@@ -299,8 +3192,7 @@ class EditCharacterDialog(QDialog):
         self.preview_label.setStyleSheet("border: none;")
         img_path = os.path.join(IMG_DIR, self.char_data["image"])
         if os.path.exists(img_path):
-            pixmap = QPixmap(img_path).scaled(60, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            self.preview_label.setPixmap(pixmap)
+            self.preview_label.setPixmap(portrait_cache.get(img_path, 60, 60))
         form_layout.addRow("预览：", self.preview_label)
 
         layout.addLayout(form_layout)
@@ -347,15 +3239,8 @@ class EditCharacterDialog(QDialog):
             QMessageBox.warning(self, "提示", "请输入角色名称")
             return
 
-        try:
-            with open(CHAR_FILE, "r", encoding="utf-8") as f:
-                characters = json.load(f)
-            for char in characters:
-                if char["name"] == name and char["name"] != self.char_data["name"]:
-                    QMessageBox.warning(self, "重复", f"角色 [{name}] 已存在")
-                    return
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"读取角色数据失败: {e}")
+        if name != self.char_data["name"] and name in character_registry:
+            QMessageBox.warning(self, "重复", f"角色 [{name}] 已存在")
             return
 
         updated_data = {
@@ -378,8 +3263,10 @@ class EditCharacterDialog(QDialog):
             try:
                 with open(self.selected_img_path, "rb") as src, open(img_dest_path, "wb") as dst:
                     dst.write(src.read())
+                invalidate_portrait(img_dest_path)
                 if img_filename != self.char_data["image"]:
                     old_img_path = os.path.join(IMG_DIR, self.char_data["image"])
+                    invalidate_portrait(old_img_path)
                     if os.path.exists(old_img_path):
                         os.remove(old_img_path)
                 updated_data["image"] = img_filename
@@ -391,12 +3278,12 @@ class EditCharacterDialog(QDialog):
         self.accept()
 
 class EditMatchDialog(QDialog):
-    def __init__(self, match_data, characters_data, data_index, parent=None):
+    def __init__(self, match_data, characters_data, match_id, parent=None):
         super().__init__(parent)
         self.setWindowTitle("详细战绩")
         self.match_data = match_data
         self.characters_data = characters_data
-        self.data_index = data_index
+        self.match_id = match_id
         self.team_a_labels = []
         self.team_b_labels = []
         self.init_ui()
@@ -409,9 +3296,8 @@ class EditMatchDialog(QDialog):
         for char_name in self.match_data.get("team_b", []):
             label = DropLabel(parent=self)
             label.character_name = char_name
-            img_path = get_character_image_path(char_name)
-            if img_path:
-                pixmap = QPixmap(img_path).scaled(60, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            pixmap = get_character_pixmap(char_name, 60, 60)
+            if pixmap:
                 label.setPixmap(pixmap)
                 label.setStyleSheet("border: none;")
             else:
@@ -426,9 +3312,8 @@ class EditMatchDialog(QDialog):
         for char_name in self.match_data.get("team_a", []):
             label = DropLabel(parent=self)
             label.character_name = char_name
-            img_path = get_character_image_path(char_name)
-            if img_path:
-                pixmap = QPixmap(img_path).scaled(60, 60, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            pixmap = get_character_pixmap(char_name, 60, 60)
+            if pixmap:
                 label.setPixmap(pixmap)
                 label.setStyleSheet("border: none;")
             else:
@@ -476,49 +3361,10 @@ class EditMatchDialog(QDialog):
         self.update_team_stats()
 
     def update_team_stats(self):
-        def calculate_team_stats(labels):
-            stats = {"2RL": 0, "2.5RL": 0, "3RL": 0, "3.5RL": 0, "4RL": 0}
-            for label in labels:
-                if label.character_name:
-                    for char in self.characters_data:
-                        if char["name"] == label.character_name:
-                            for attr in stats:
-                                stats[attr] += float(char.get(attr, 0))
-            return stats
-
-        def format_stat(value, stat_name, is_first_highlight):
-            formatted_value = f"{value:.1f}"
-            if is_first_highlight:
-                return f"<span style='color: red; font-weight: bold;'>{stat_name}: {formatted_value}</span>"
-            return f"{stat_name}: {formatted_value}"
-
-        team_a_stats = calculate_team_stats(self.team_a_labels)
-        team_b_stats = calculate_team_stats(self.team_b_labels)
-
-        first_a_highlight = None
-        for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]:
-            if team_a_stats[attr] >= 100:
-                first_a_highlight = attr
-                break
-
-        first_b_highlight = None
-        for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]:
-            if team_b_stats[attr] >= 100:
-                first_b_highlight = attr
-                break
-
-        team_a_text = "进攻方: " + " | ".join(
-            format_stat(team_a_stats[attr], attr, attr == first_a_highlight)
-            for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]
-        )
-
-        team_b_text = "防守方: " + " | ".join(
-            format_stat(team_b_stats[attr], attr, attr == first_b_highlight)
-            for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]
-        )
-
-        self.team_a_stats.setText(team_a_text)
-        self.team_b_stats.setText(team_b_text)
+        team_a = [label.character_name for label in self.team_a_labels if label.character_name]
+        team_b = [label.character_name for label in self.team_b_labels if label.character_name]
+        self.team_a_stats.setText(format_team_stats("进攻方", team_a))
+        self.team_b_stats.setText(format_team_stats("防守方", team_b))
 
     def save_changes(self):
         team_a = [label.character_name for label in self.team_a_labels if label.character_name]
@@ -530,10 +3376,9 @@ class EditMatchDialog(QDialog):
             QMessageBox.warning(self, "提示", "请至少选择一个角色")
             return
 
-        all_char_names = {char["name"] for char in self.characters_data}
         missing_chars = []
         for char_name in team_a + team_b:
-            if char_name and char_name not in all_char_names:
+            if char_name and char_name not in character_registry:
                 missing_chars.append(char_name)
 
         if missing_chars:
@@ -570,7 +3415,7 @@ class DuplicateCharacterDialog(QDialog):
 
         for row, new_char in enumerate(self.duplicates):
             name = new_char["name"]
-            existing_char = next((char for char in self.existing_chars if char["name"] == name), None)
+            existing_char = character_registry.get(name) or {}
 
             name_item = QTableWidgetItem(name)
             name_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
@@ -647,47 +3492,59 @@ class DuplicateCharacterDialog(QDialog):
             self.choices[name] = "skip"
 
 class MatchListItem(QWidget):
-    def __init__(self, match_data, data_index, parent=None):
+    # 头像和结果标签只创建一次，set_match 原地替换内容
+    def __init__(self, match_data=None, parent=None):
         super().__init__(parent)
-        self.match_data = match_data
-        self.data_index = data_index
+        self.match_data = None
         self.layout = QHBoxLayout(self)
         self.layout.setContentsMargins(5, 5, 5, 5)
 
-        team_a_layout = QHBoxLayout()
-        for char_name in match_data.get("team_a", []):
-            label = QLabel()
-            label.setFixedSize(40, 40)
-            img_path = get_character_image_path(char_name)
-            if img_path:
-                pixmap = QPixmap(img_path).scaled(40, 40, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-                label.setPixmap(pixmap)
-            else:
-                label.setText(char_name)
-                label.setStyleSheet("border: 1px solid #ccc;")
-            team_a_layout.addWidget(label)
-        self.layout.addLayout(team_a_layout)
+        self.team_a_layout = QHBoxLayout()
+        self.team_a_labels = []
+        self.layout.addLayout(self.team_a_layout)
 
         vs_label = QLabel("VS")
         vs_label.setStyleSheet("color: #00000B; font-size: 16px;")
         self.layout.addWidget(vs_label)
 
-        team_b_layout = QHBoxLayout()
-        for char_name in match_data.get("team_b", []):
+        self.team_b_layout = QHBoxLayout()
+        self.team_b_labels = []
+        self.layout.addLayout(self.team_b_layout)
+
+        self.result_label = QLabel()
+        self.layout.addWidget(self.result_label)
+        if match_data is not None:
+            self.set_match(match_data)
+
+    def set_team(self, team_layout, labels, team):
+        while len(labels) < max(len(team), 5):
             label = QLabel()
             label.setFixedSize(40, 40)
-            img_path = get_character_image_path(char_name)
-            if img_path:
-                pixmap = QPixmap(img_path).scaled(40, 40, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+            team_layout.addWidget(label)
+            labels.append(label)
+        for i, label in enumerate(labels):
+            if i >= len(team):
+                label.hide()
+                continue
+            char_name = team[i]
+            pixmap = get_character_pixmap(char_name, 40, 40, Qt.KeepAspectRatioByExpanding)
+            if pixmap:
                 label.setPixmap(pixmap)
+                label.setStyleSheet("")
             else:
                 label.setText(char_name)
                 label.setStyleSheet("border: 1px solid #ccc;")
-            team_b_layout.addWidget(label)
-        self.layout.addLayout(team_b_layout)
+            label.show()
+
+    def set_match(self, match_data):
+        if match_data == self.match_data:
+            return
+        self.match_data = dict(match_data)
+        self.set_team(self.team_a_layout, self.team_a_labels, match_data.get("team_a", []))
+        self.set_team(self.team_b_layout, self.team_b_labels, match_data.get("team_b", []))
 
         result = match_data.get("result", "未知")
-        result_label = QLabel(result)
+        self.result_label.setText(result)
         result_style = (
             "font-family: 'Microsoft YaHei', Arial, sans-serif; "
             "font-weight: bold; "
@@ -699,51 +3556,403 @@ class MatchListItem(QWidget):
             result_style += "color: #dc3545;"
         else:
             result_style += "color: #555;"
-        result_label.setStyleSheet(result_style)
-        self.layout.addWidget(result_label)
+        self.result_label.setStyleSheet(result_style)
+
+MATCH_DATA_ROLE = Qt.UserRole
+MATCH_ID_ROLE = Qt.UserRole + 1
+
+class MatchListModel(QAbstractListModel):
+    # 每行只保存战绩 id，数据按需从 match_store 取，绘制交给 MatchItemDelegate
+    # 后台加载期间 source 指向加载任务里已建好的表，装入 match_store 后再切回
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        self.source = None
+
+    def set_rows(self, match_ids, source=None):
+        self.beginResetModel()
+        self._rows = match_ids
+        self.source = source
+        self.endResetModel()
+
+    def append_rows(self, match_ids):
+        if not match_ids:
+            return
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(match_ids) - 1)
+        self._rows.extend(match_ids)
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        match_id = self._rows[index.row()]
+        if role == MATCH_ID_ROLE:
+            return match_id
+        match = self.source.view(match_id) if self.source is not None else match_store.get(match_id)
+        if match is None:
+            return None
+        if role == MATCH_DATA_ROLE:
+            return match
+        if role == Qt.DisplayRole:
+            return (f"{' '.join(match.get('team_a', []))} VS {' '.join(match.get('team_b', []))} "
+                    f"{match.get('result', '')}")
+        return None
+
+class MatchItemDelegate(QStyledItemDelegate):
+    # 直接绘制头像、VS 和结果，不再为每条战绩创建 QLabel
+    PORTRAIT_SIZE = 40
+    SPACING = 4
+    MARGIN = 5
+    TEAM_SLOTS = 5
+    VS_WIDTH = 30
+    RESULT_COLORS = {"胜": "#28a745", "败": "#dc3545"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.vs_font = QFont()
+        self.vs_font.setPixelSize(16)
+        self.result_font = QFont("Microsoft YaHei")
+        self.result_font.setPixelSize(24)
+        self.result_font.setBold(True)
+
+    def sizeHint(self, option, index):
+        team_width = self.TEAM_SLOTS * (self.PORTRAIT_SIZE + self.SPACING)
+        return QSize(2 * team_width + self.VS_WIDTH + self.SPACING + 30, self.PORTRAIT_SIZE + 2 * self.MARGIN)
+
+    def paint_team(self, painter, option, x, y, team):
+        size = self.PORTRAIT_SIZE
+        for name in team:
+            rect = QRect(x, y, size, size)
+            pixmap = get_character_pixmap(name, size, size, Qt.KeepAspectRatioByExpanding)
+            if pixmap:
+                source = QRect((pixmap.width() - size) // 2, (pixmap.height() - size) // 2, size, size)
+                painter.drawPixmap(rect, pixmap, source)
+            else:
+                painter.setFont(option.font)
+                painter.setPen(QColor("#ccc"))
+                painter.drawRect(rect.adjusted(0, 0, -1, -1))
+                painter.setPen(option.palette.text().color())
+                painter.drawText(rect, Qt.AlignCenter, QFontMetrics(option.font).elidedText(name, Qt.ElideRight, size))
+            x += size + self.SPACING
+        return x
+
+    def paint(self, painter, option, index):
+        match = index.data(MATCH_DATA_ROLE)
+        if match is None:
+            super().paint(painter, option, index)
+            return
+        painter.save()
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+        rect = option.rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        y = rect.top() + (rect.height() - self.PORTRAIT_SIZE) // 2
+        team_width = self.TEAM_SLOTS * (self.PORTRAIT_SIZE + self.SPACING)
+
+        self.paint_team(painter, option, rect.left(), y, match.get("team_a", []))
+        x = rect.left() + team_width
+        painter.setFont(self.vs_font)
+        painter.setPen(QColor("#00000B"))
+        painter.drawText(QRect(x, rect.top(), self.VS_WIDTH, rect.height()), Qt.AlignCenter, "VS")
+        x += self.VS_WIDTH + self.SPACING
+        self.paint_team(painter, option, x, y, match.get("team_b", []))
+        x += team_width
+
+        result = match.get("result", "未知")
+        painter.setFont(self.result_font)
+        painter.setPen(QColor(self.RESULT_COLORS.get(result, "#555")))
+        painter.drawText(QRect(x, rect.top(), max(rect.right() - x, 0), rect.height()),
+                         Qt.AlignLeft | Qt.AlignVCenter, result)
+        painter.restore()
 
 class LatestMatchPreview(QWidget):
+    ROW_COUNT = 3
+
     def __init__(self, matches_data=None, parent=None):
         super().__init__(parent)
-        self.matches_data = matches_data if matches_data else []
+        self.matches_data = []
         self.setup_ui()
+        self.update_preview(matches_data)
 
     def setup_ui(self):
-        if self.layout():
-            QWidget().setLayout(self.layout())
         layout = QVBoxLayout()
         layout.setContentsMargins(5, 5, 5, 5)
         title_label = QLabel("最新战绩预览")
         title_label.setStyleSheet("font-weight: bold; color: #333;")
         layout.addWidget(title_label)
 
-        if not self.matches_data:
-            no_match_label = QLabel("暂无战绩记录")
-            no_match_label.setAlignment(Qt.AlignCenter)
-            no_match_label.setStyleSheet("color: #555; font-style: italic;")
-            layout.addWidget(no_match_label)
-        else:
-            for match_data in reversed(self.matches_data[-3:]):
-                match_widget = MatchListItem(match_data, 0)
-                layout.addWidget(match_widget)
+        self.no_match_label = QLabel("暂无战绩记录")
+        self.no_match_label.setAlignment(Qt.AlignCenter)
+        self.no_match_label.setStyleSheet("color: #555; font-style: italic;")
+        layout.addWidget(self.no_match_label)
+
+        self.match_rows = []
+        for _ in range(self.ROW_COUNT):
+            match_widget = MatchListItem()
+            match_widget.hide()
+            layout.addWidget(match_widget)
+            self.match_rows.append(match_widget)
 
         self.setLayout(layout)
         single_match_height = 50
         title_height = 30
         margins = 10
-        self.setFixedHeight(title_height + single_match_height * 3 + margins)
+        self.setFixedHeight(title_height + single_match_height * self.ROW_COUNT + margins)
 
     def update_preview(self, matches_data=None):
+        # 只更新已有的行，不重建控件树
         self.matches_data = matches_data if matches_data else []
-        self.setup_ui()
+        latest = list(reversed(self.matches_data[-self.ROW_COUNT:]))
+        self.no_match_label.setVisible(not latest)
+        for i, match_widget in enumerate(self.match_rows):
+            if i < len(latest):
+                match_widget.set_match(latest[i])
+                match_widget.show()
+            else:
+                match_widget.hide()
+
+class CounterPickDialog(QDialog):
+    # 针对一套防守的进攻推荐；双击一行把该进攻阵容填入拖放搜索的进攻方并搜索
+    def __init__(self, defense, recommendations, parent=None):
+        super().__init__(parent)
+        self.parent_widget = parent
+        self.recommendations = recommendations
+        self.setWindowTitle("推荐进攻")
+        self.resize(720, 420)
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("防守方: " + " / ".join(defense)))
+        self.table = QTableWidget(len(recommendations), 5)
+        self.table.setHorizontalHeaderLabels(["进攻方", "加权胜率", "加权场次", "完全一致 胜/场", "评分"])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        for row, rec in enumerate(recommendations):
+            self.table.setItem(row, 0, QTableWidgetItem(" / ".join(rec["team_a"])))
+            self.table.setItem(row, 1, QTableWidgetItem(f"{rec['win_rate']:.1%}"))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{rec['weighted_attempts']:.1f}"))
+            self.table.setItem(row, 3, QTableWidgetItem(f"{rec['exact_wins']}/{rec['exact_attempts']}"))
+            self.table.setItem(row, 4, QTableWidgetItem(f"{rec['score']:.3f}"))
+        self.table.cellDoubleClicked.connect(self.use_attack)
+        layout.addWidget(self.table)
+        layout.addWidget(QLabel("评分为加权胜率的 Wilson 下界；成员重叠的防守按 Jaccard 相似度计入"))
+        self.setLayout(layout)
+
+    def use_attack(self, row, column):
+        team = self.recommendations[row]["team_a"]
+        for label in self.parent_widget.team_a_search_labels:
+            label.clear_label()
+        for label, name in zip(self.parent_widget.team_a_search_labels, team):
+            label.set_character(name)
+        self.parent_widget.search_by_drag()
+
+def parse_match_query(search_query, resolve_name):
+    # 解析成析取范式：每个 AND 组是去重排序后的 (字段, 小写值, 是否取反) 元组。空白分隔的条件为 AND，
+    # OR 或 | 分隔各组；-前缀表示排除；双引号包住含空格的内容；值为空的条件（输入到一半的 a: 等）忽略。
+    # resolve_name(字段, 词) 把 a:/d:/不带前缀的词换成角色名
+    lexer = shlex.shlex(search_query, posix=True)
+    lexer.whitespace_split = True
+    lexer.quotes = '"'
+    lexer.escape = ""
+    lexer.commenters = ""
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        # 引号还没输完时当作在末尾闭合
+        return parse_match_query(search_query + '"', resolve_name)
+
+    def resolve_term(term):
+        if term.startswith("n:"):
+            return ("notes", term[2:])
+        elif term.startswith("r:"):
+            return ("result", term[2:])
+        kind, value = {"a:": "team_a", "d:": "team_b"}.get(term[:2]), term[2:]
+        if kind is None:
+            kind, value = "any", term
+        return (kind, resolve_name(kind, value).lower() if value else value)
+
+    groups = [set()]
+    for token in tokens:
+        if token in ("or", "|"):
+            groups.append(set())
+            continue
+        negated = token.startswith("-")
+        kind, value = resolve_term(token[1:] if negated else token)
+        if value:
+            groups[-1].add((kind, value, negated))
+    return tuple(dict.fromkeys(tuple(sorted(group)) for group in groups if group))
+
+QUERY_PREFIXES = {"team_a": "a:", "team_b": "d:", "notes": "n:", "result": "r:", "any": ""}
+
+def format_query_predicate(predicate):
+    kind, value, negated = predicate
+    value = f'"{value}"' if " " in value else value
+    return f"{'-' if negated else ''}{QUERY_PREFIXES[kind]}{value}"
+
+def filter_postings(match_ids, posting, keep=True):
+    # 保留（keep=False 时去掉）出现在倒排表里的 id；候选远少于倒排表时逐个二分，否则转成集合
+    if len(match_ids) * 8 < len(posting):
+        def contains(match_id):
+            pos = bisect.bisect_left(posting, match_id)
+            return pos < len(posting) and posting[pos] == match_id
+    else:
+        contains = set(posting).__contains__
+    return [match_id for match_id in match_ids if contains(match_id) == keep]
+
+class MatchQueryPlan:
+    # 一个 AND 组的执行计划。a:/d: 条件直接取角色倒排表，按长度从短到长求交得到候选；没有这类条件时
+    # 取预估命中最少的一个正向条件作为候选（备注走 bigram 索引，结果扫一遍结果列）。其余条件按代价
+    # 从低到高（结果、排除角色、备注子串）只在剩下的候选上逐条过滤。base_ids 为已知的候选（缓存结果）
+    SEED_KINDS = ("team_a", "team_b")
+    FILTER_COSTS = {"result": 0, "team_a": 1, "team_b": 1, "any": 2, "notes": 2}
+
+    def __init__(self, store, group, base_ids=None):
+        self.store = store
+        self.group = group
+        self.base_ids = base_ids
+        self.total = len(store)
+        self.estimates = {predicate: self.estimate(predicate) for predicate in group}
+        seeds = [predicate for predicate in group if predicate[0] in self.SEED_KINDS and not predicate[2]]
+        positive = [predicate for predicate in group if not predicate[2]]
+        if not seeds and base_ids is None and positive:
+            seeds = [min(positive, key=self.estimates.get)]
+        self.seeds = sorted(seeds, key=self.estimates.get)
+        self.filters = sorted((predicate for predicate in group if predicate not in seeds),
+                              key=lambda predicate: (self.FILTER_COSTS[predicate[0]], self.estimates[predicate]))
+        self.timings = []
+
+    def member_ids(self, kind, value):
+        return self.store.ids_with_member(value, {"team_a": "a", "team_b": "d", "any": None}[kind])
+
+    def estimate(self, predicate):
+        kind, value, negated = predicate
+        if kind in self.SEED_KINDS:
+            count = len(self.member_ids(kind, value))
+        elif kind == "notes":
+            count = self.store.notes_estimate(value)
+        elif kind == "any":
+            count = min(self.total, len(self.member_ids(kind, value)) + self.store.notes_estimate(value))
+        else:
+            count = self.store.result_count(value)
+        return self.total - count if negated else count
+
+    def seed_ids(self, predicate):
+        kind, value, _ = predicate
+        if kind in self.SEED_KINDS:
+            return self.member_ids(kind, value)
+        if kind == "notes":
+            return self.store.ids_with_notes(value)
+        if kind == "any":
+            return union_postings([self.member_ids(kind, value), self.store.ids_with_notes(value)])
+        return self.store.ids_with_result(value)
+
+    def apply_filter(self, predicate, match_ids):
+        kind, value, negated = predicate
+        if kind == "result":
+            return self.store.filter_ids(match_ids, "result", lambda result: (result == value) != negated)
+        if kind in self.SEED_KINDS:
+            return filter_postings(match_ids, self.member_ids(kind, value), keep=not negated)
+        notes_match = self.store.filter_ids(match_ids, "notes", lambda notes: value in (notes or "").lower())
+        if kind == "any":
+            matched = set(filter_postings(match_ids, self.member_ids(kind, value))).union(notes_match)
+        else:
+            matched = set(notes_match)
+        return [match_id for match_id in match_ids if (match_id in matched) != negated]
+
+    def run(self):
+        # 返回按 id 升序的结果，并在 timings 里记下每一步 (说明, 预估, 结果条数, 秒)
+        self.timings = []
+        started = time.perf_counter()
+
+        def record(label, estimate, match_ids):
+            nonlocal started
+            now = time.perf_counter()
+            self.timings.append((label, estimate, len(match_ids), now - started))
+            started = now
+
+        posting_lists = [] if self.base_ids is None else [self.base_ids]
+        if self.base_ids is not None:
+            record("沿用缓存结果", len(self.base_ids), self.base_ids)
+        for predicate in self.seeds:
+            posting_lists.append(self.seed_ids(predicate))
+            record(f"索引 {format_query_predicate(predicate)}", self.estimates[predicate], posting_lists[-1])
+        if posting_lists:
+            match_ids = intersect_postings(posting_lists)
+            if len(posting_lists) > 1:
+                record("求交", min(map(len, posting_lists)), match_ids)
+        else:
+            match_ids = sorted(self.store.ids())
+            record("全部战绩", self.total, match_ids)
+        for predicate in self.filters:
+            if not match_ids:
+                break
+            match_ids = self.apply_filter(predicate, match_ids)
+            record(f"过滤 {format_query_predicate(predicate)}", self.estimates[predicate], match_ids)
+        return match_ids
+
+    def explain(self):
+        lines = [" ".join(format_query_predicate(predicate) for predicate in self.seeds + self.filters)]
+        for step, (label, estimate, count, seconds) in enumerate(self.timings, 1):
+            lines.append(f"  {step}. {label}：预估 {estimate}，得到 {count} 条，{seconds * 1000:.2f} ms")
+        return "\n".join(lines)
+
+class SearchResultCache:
+    # 最近搜索结果的 LRU，键为 (规范化后的条件, 战绩版本, 角色表版本)，值为按 id 升序的结果
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def get(self, conditions, versions):
+        key = (conditions, versions)
+        ids = self._entries.get(key)
+        if ids is not None:
+            self._entries.move_to_end(key)
+        return ids
+
+    def put(self, conditions, versions, ids):
+        self._entries[(conditions, versions)] = ids
+        self._entries.move_to_end((conditions, versions))
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def closest_subset(self, conditions, versions):
+        # 条件是新查询真子集的缓存项里结果最少的一个，新查询只需在它上面继续求交
+        wanted = set(conditions)
+        best = ((), None)
+        for (cached_conditions, cached_versions), ids in self._entries.items():
+            if cached_versions != versions or not set(cached_conditions) < wanted:
+                continue
+            if best[1] is None or len(ids) < len(best[1]):
+                best = (cached_conditions, ids)
+        return best
 
 class MatchViewer(QDialog):
+    # 后台加载时先显示最前面一屏，之后每个定时器周期追加一批
+    FIRST_CHUNK = 50
+    STREAM_CHUNK = 5000
+    SEARCH_DEBOUNCE_MS = 250
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("查看战绩")
         self.setMinimumSize(1000, 800)
         self.matches_data = []
         self.characters_data = []
+        self.displayed_ids = []
+        self.load_job = None
+        self.stream_ids = None
+        self.load_timer = QTimer(self)
+        self.load_timer.setInterval(30)
+        self.load_timer.timeout.connect(self.stream_matches)
+        self.search_cache = SearchResultCache()
+        self.search_corrections = {}
+        self.unresolved_terms = []
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(lambda: self.search_matches(live=True))
         self.init_ui()
         self.load_matches()
 
@@ -757,19 +3966,31 @@ class MatchViewer(QDialog):
         search_layout = QVBoxLayout()
         search_input_layout = QHBoxLayout()
         self.search_input = DroppableLineEdit()
-        self.search_input.setPlaceholderText("输入搜索内容角色名（a:进攻 d:防守 n:备注 空格为AND）")
+        self.search_input.setPlaceholderText("角色名/备注（a:进攻 d:防守 n:备注 r:胜/败 -排除 OR 或）")
+        self.search_input.setToolTip("空格分隔的条件同时满足（AND），OR 或 | 分隔的几组满足其一即可；\n"
+                                     "a:/d:/n:/r: 分别限定进攻方、防守方、备注、结果，前加 - 表示排除；\n"
+                                     "含空格的内容用双引号包住，如 n:\"先手 爆裂\"")
+        # 输入停顿后自动搜索
+        self.search_input.textChanged.connect(lambda _: self.search_timer.start())
         search_input_layout.addWidget(self.search_input)
         search_btn = QPushButton("搜索")
         search_btn.setStyleSheet(BUTTON_STYLE["primary"])
-        search_btn.clicked.connect(self.search_matches)
+        search_btn.clicked.connect(lambda: self.search_matches())
         search_input_layout.addWidget(search_btn)
         clear_search_btn = QPushButton("清除")
         clear_search_btn.setStyleSheet(BUTTON_STYLE["secondary"])
         clear_search_btn.clicked.connect(self.clear_search_and_display_all)
         search_input_layout.addWidget(clear_search_btn)
+        explain_btn = QPushButton("计划")
+        explain_btn.setStyleSheet(BUTTON_STYLE["secondary"])
+        explain_btn.clicked.connect(self.explain_search)
+        search_input_layout.addWidget(explain_btn)
         search_layout.addLayout(search_input_layout)
+        self.search_status_label = QLabel("")
+        search_layout.addWidget(self.search_status_label)
         search_group.setLayout(search_layout)
         left_layout.addWidget(search_group)
+        self.search_group = search_group
 
         drag_search_group = QGroupBox("拖放搜索")
         drag_search_layout = QVBoxLayout()
@@ -796,15 +4017,46 @@ class MatchViewer(QDialog):
         clear_drag_btn = QPushButton("清除")
         clear_drag_btn.setStyleSheet(BUTTON_STYLE["secondary"])
         clear_drag_btn.clicked.connect(self.clear_drag_search)
+        recommend_btn = QPushButton("推荐进攻")
+        recommend_btn.setStyleSheet(BUTTON_STYLE["primary"])
+        recommend_btn.clicked.connect(self.recommend_attacks)
         drag_search_btn_layout.addWidget(search_drag_btn)
+        drag_search_btn_layout.addWidget(recommend_btn)
         drag_search_btn_layout.addWidget(clear_drag_btn)
         drag_search_layout.addLayout(drag_search_btn_layout)
         drag_search_group.setLayout(drag_search_layout)
         left_layout.addWidget(drag_search_group)
-
-        self.match_list_widget = QListWidget()
-        self.match_list_widget.setSelectionMode(QListWidget.ExtendedSelection)
-        left_layout.addWidget(self.match_list_widget)
+        self.drag_search_group = drag_search_group
+
+        view_mode_layout = QHBoxLayout()
+        view_mode_layout.addWidget(QLabel("显示："))
+        self.view_mode_combo = QComboBox()
+        self.view_mode_combo.addItems(["按战绩", "按防守分组"])
+        self.view_mode_combo.currentIndexChanged.connect(lambda _: self.display_matches(self.displayed_ids))
+        view_mode_layout.addWidget(self.view_mode_combo)
+        view_mode_layout.addStretch()
+        left_layout.addLayout(view_mode_layout)
+
+        self.load_status_label = QLabel("")
+        self.load_status_label.hide()
+        left_layout.addWidget(self.load_status_label)
+        self.match_model = MatchListModel(self)
+        self.match_list_view = QListView()
+        self.match_list_view.setModel(self.match_model)
+        self.match_list_view.setItemDelegate(MatchItemDelegate(self.match_list_view))
+        self.match_list_view.setUniformItemSizes(True)
+        self.match_list_view.setSelectionMode(QListView.ExtendedSelection)
+        left_layout.addWidget(self.match_list_view)
+        self.group_table = QTableWidget(0, 5)
+        self.group_table.setHorizontalHeaderLabels(["防守方", "场次", "胜/败", "胜率", "最佳进攻 (胜/场)"])
+        self.group_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.group_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.group_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.group_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.group_table.cellDoubleClicked.connect(self.show_group_matches)
+        self.group_table.hide()
+        left_layout.addWidget(self.group_table)
+        self.defense_groups = []
 
         button_layout = QHBoxLayout()
         select_all_btn = QPushButton("全选")
@@ -847,11 +4099,11 @@ class MatchViewer(QDialog):
         right_layout.addLayout(filter_layout)
         char_list_group = QGroupBox("角色列表")
         char_list_layout = QVBoxLayout()
-        self.list_widget = DraggableListWidget(parent=self)
+        self.list_widget = CharacterListView(parent=self)
         self.list_widget.setIconSize(QSize(60, 60))
         self.list_widget.setViewMode(QListView.IconMode)
-        self.list_widget.setResizeMode(QListWidget.Adjust)
-        self.list_widget.setSelectionMode(QListWidget.ExtendedSelection)
+        self.list_widget.setResizeMode(QListView.Adjust)
+        self.list_widget.setSelectionMode(QListView.ExtendedSelection)
         char_list_layout.addWidget(self.list_widget)
         char_list_group.setLayout(char_list_layout)
         right_layout.addWidget(char_list_group)
@@ -870,121 +4122,132 @@ class MatchViewer(QDialog):
         self.filter_rank_combo.currentTextChanged.connect(self.filter_characters)
 
     def filter_characters(self):
-        self.list_widget.clear()
-        QApplication.processEvents()
-        selected_type = self.filter_type_combo.currentText()
-        selected_rank = self.filter_rank_combo.currentText()
-        is_filtered = (selected_type != "所有类型" or selected_rank != "所有爆裂")
-        icon_cache = {}
-        filtered_chars = []
-        for char in self.characters_data:
-            char_type = char.get("type", "")
-            char_rank = char.get("rank", "")
-            type_match = (selected_type == "所有类型" or char_type == selected_type)
-            rank_match = (selected_rank == "所有爆裂" or char_rank == selected_rank)
-            if type_match and rank_match:
-                filtered_chars.append(char)
-        for char in filtered_chars:
-            name = char["name"]
-            item = QListWidgetItem()
-            img_path = os.path.join(IMG_DIR, char["image"])
-            if img_path not in icon_cache:
-                if os.path.exists(img_path):
-                    icon_cache[img_path] = QIcon(img_path)
-                else:
-                    icon_cache[img_path] = QIcon()
-            item.setIcon(icon_cache[img_path])
-            item.setData(Qt.UserRole, name)
-            font_metrics = self.list_widget.fontMetrics()
-            elided_name = font_metrics.elidedText(name, Qt.ElideRight, 60)
-            item.setText(elided_name)
-            tooltip_text = (
-                f"<p style='font-family: Arial; font-size: 12px;'>"
-                f"<table>"
-                f"<tr><td style='width: 80px;'>名称:</td><td>{char.get('name', '')}</td></tr>"
-                f"<tr><td style='width: 80px;'>昵称:</td><td>{char.get('nickname', '') or 'none'}</td></tr>"
-                f"<tr><td style='width: 80px;'>类型:</td><td>{char.get('type', '') or '未设置'}</td></tr>"
-                f"<tr><td style='width: 80px;'>等级:</td><td>{char.get('rank', '') or '未设置'}</td></tr>"
-                f"<tr><td style='width: 80px;'>2RL:</td><td>{char.get('2RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>2.5RL:</td><td>{char.get('2.5RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>3RL:</td><td>{char.get('3RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>3.5RL:</td><td>{char.get('3.5RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>4RL:</td><td>{char.get('4RL', 0):.1f}</td></tr>"
-                f"</table>"
-                f"</p>"
-            )
-            item.setToolTip(tooltip_text)
-            item.setTextAlignment(Qt.AlignHCenter)
-            item.setSizeHint(QSize(60, 80))
-            self.list_widget.addItem(item)
+        self.list_widget.set_filters(self.filter_type_combo.currentText(), self.filter_rank_combo.currentText())
 
     def select_all_matches(self):
-        for i in range(self.match_list_widget.count()):
-            item = self.match_list_widget.item(i)
-            item.setSelected(True)
+        self.match_list_view.selectAll()
+
+    def selected_match_rows(self):
+        indexes = sorted(self.match_list_view.selectionModel().selectedRows(), key=lambda index: index.row())
+        return [(index.data(MATCH_ID_ROLE), index.data(MATCH_DATA_ROLE)) for index in indexes]
 
     def load_matches(self):
-        try:
-            with open(MATCH_FILE, "r", encoding="utf-8") as f:
-                self.matches_data = json.load(f)
-        except json.JSONDecodeError:
-            self.matches_data = []
-        try:
-            with open(CHAR_FILE, "r", encoding="utf-8") as f:
-                self.characters_data = json.load(f)
-        except json.JSONDecodeError:
-            self.characters_data = []
-        self.display_matches()
+        self.characters_data = character_registry.characters()
         self.filter_characters()
-
-    def display_matches(self, filtered_matches=None):
-        self.match_list_widget.clear()
-        matches_to_display = filtered_matches if filtered_matches is not None else self.matches_data
-        for index, match in enumerate(self.matches_data):
-            if filtered_matches is not None:
-                if match not in filtered_matches:
-                    continue
-            else:
-                # When not filtered, use the original index
-                original_index = index
-            # When filtered, find the original index in matches_data
-            original_index = self.matches_data.index(match) if filtered_matches is not None else index
-            item = QListWidgetItem(self.match_list_widget)
-            custom_widget = MatchListItem(match, original_index)
-            item.setSizeHint(custom_widget.sizeHint())
-            self.match_list_widget.addItem(item)
-            self.match_list_widget.setItemWidget(item, custom_widget)
+        job = match_store.load_in_background()
+        if job is None:
+            self.matches_data = match_store.matches()
+            self.display_matches()
+            return
+        if job is self.load_job:
+            return
+        # 战绩还在后台加载：搜索等依赖索引的操作先禁用，表一建好就从最新的战绩开始分批显示
+        self.load_job = job
+        job.attach()
+        self.stream_ids = None
+        self.match_model.set_rows([])
+        self.set_loading(True)
+        self.load_timer.start()
+
+    def set_loading(self, loading):
+        for widget in (self.search_group, self.drag_search_group, self.view_mode_combo):
+            widget.setEnabled(not loading)
+        self.load_status_label.setVisible(loading)
+
+    def stream_matches(self):
+        job = self.load_job
+        if self.stream_ids is None and job.table is not None:
+            self.stream_ids = job.table.ids.tolist()[::-1]
+            self.match_model.set_rows(self.stream_ids[:self.FIRST_CHUNK], source=job.table)
+        elif self.stream_ids is not None:
+            shown = self.match_model.rowCount()
+            self.match_model.append_rows(self.stream_ids[shown:shown + self.STREAM_CHUNK])
+        if self.stream_ids is None:
+            self.load_status_label.setText(f"正在{job.stage}…")
+        else:
+            self.load_status_label.setText(f"正在{job.stage}… 已显示 {self.match_model.rowCount()}/{len(self.stream_ids)} 条")
+        if match_store.poll_loading():
+            self.finish_loading()
+
+    def finish_loading(self):
+        self.load_timer.stop()
+        self.load_job.detach()
+        self.load_job = None
+        self.set_loading(False)
+        self.matches_data = match_store.matches()
+        ids = [match["id"] for match in self.matches_data]
+        if self.stream_ids == ids[::-1] and self.view_mode_combo.currentIndex() == 0:
+            # 已显示的行就是最终结果：补齐剩余行、切回 match_store，不重置模型以保留滚动位置和选择
+            self.displayed_ids = ids
+            self.match_model.append_rows(self.stream_ids[self.match_model.rowCount():])
+            self.match_model.source = None
+        else:
+            self.display_matches()
+        self.stream_ids = None
+
+    def done(self, result):
+        # 关窗时停止分批显示；若没有其他窗口在等，后台加载也一并取消
+        if self.load_job is not None:
+            self.load_timer.stop()
+            self.load_job.detach()
+            self.load_job = None
+            match_store.poll_loading()
+        character_registry.flush_order()
+        super().done(result)
+
+    def display_matches(self, filtered_ids=None):
+        if filtered_ids is None:
+            filtered_ids = [match["id"] for match in self.matches_data]
+        self.displayed_ids = list(filtered_ids)
+        grouped = self.view_mode_combo.currentIndex() == 1
+        self.match_list_view.setVisible(not grouped)
+        self.group_table.setVisible(grouped)
+        if grouped:
+            self.display_defense_groups(self.displayed_ids)
+        else:
+            # 最新的战绩排在最前面
+            self.match_model.set_rows(self.displayed_ids[::-1])
+
+    def display_defense_groups(self, match_ids):
+        self.defense_groups = match_store.group_by_defense(match_ids)
+        self.group_table.setRowCount(len(self.defense_groups))
+        for row, group in enumerate(self.defense_groups):
+            attempts = len(group["ids"])
+            wins = group["wins"]
+            best_wins, best_attempts, best_team = group["best_attack"]
+            self.group_table.setItem(row, 0, QTableWidgetItem(" ".join(group["team_b"])))
+            self.group_table.setItem(row, 1, QTableWidgetItem(str(attempts)))
+            self.group_table.setItem(row, 2, QTableWidgetItem(f"{wins}/{attempts - wins}"))
+            self.group_table.setItem(row, 3, QTableWidgetItem(f"{wins / attempts:.1%}"))
+            self.group_table.setItem(row, 4, QTableWidgetItem(
+                f"{' '.join(best_team)} ({best_wins}/{best_attempts})"))
+
+    def show_group_matches(self, row, column):
+        # 双击分组切回战绩列表，只显示这套防守的战绩
+        group_ids = self.defense_groups[row]["ids"]
+        self.view_mode_combo.blockSignals(True)
+        self.view_mode_combo.setCurrentIndex(0)
+        self.view_mode_combo.blockSignals(False)
+        self.display_matches(group_ids)
 
     def edit_match(self):
-        selected_items = self.match_list_widget.selectedItems()
-        if not selected_items:
+        selected_rows = self.selected_match_rows()
+        if not selected_rows:
             QMessageBox.information(self, "提示", "请先选择一条战绩记录进行查看。")
             return
-        if len(selected_items) > 1:
+        if len(selected_rows) > 1:
             QMessageBox.information(self, "提示", "一次只能查看一条战绩记录。")
             return
 
-        item = selected_items[0]
-        widget = self.match_list_widget.itemWidget(item)
-        if not widget:
+        match_id, match_data = selected_rows[0]
+        if match_data is None:
             QMessageBox.critical(self, "错误", "无法获取战绩数据。")
             return
-
-        match_data = widget.match_data
-        data_index = widget.data_index
-        dialog = EditMatchDialog(match_data, self.characters_data, data_index, self)
+        dialog = EditMatchDialog(match_data, self.characters_data, match_id, self)
         if dialog.exec_():
             updated_data = dialog.updated_data
             try:
-                with open(MATCH_FILE, "r+", encoding="utf-8") as f:
-                    matches = json.load(f)
-                    if 0 <= data_index < len(matches):
-                        matches[data_index] = updated_data
-                    else:
-                        raise IndexError("Invalid match index")
-                    f.seek(0)
-                    json.dump(matches, f, indent=2, ensure_ascii=False)
-                    f.truncate()
+                match_store.update(dialog.match_id, updated_data)
                 self.load_matches()
                 if self.parent():
                     self.parent().update_match()
@@ -992,57 +4255,92 @@ class MatchViewer(QDialog):
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"更新战绩失败: {e}")
 
-    def search_matches(self):
+    def search_matches(self, live=False):
+        # live 为输入防抖触发的搜索：没有结果时只清空列表并在下方提示，不弹窗打断输入
+        self.search_timer.stop()
         search_query = self.search_input.text().strip().lower()
-        if not search_query:
+        self.search_corrections = {}
+        self.unresolved_terms = []
+        groups = parse_match_query(search_query, self.resolve_search_term)
+        if not groups:
+            self.search_status_label.clear()
             self.display_matches()
             return
 
-        found_matches = []
-        nickname_to_name = {char.get("nickname", "").lower(): char["name"] for char in self.characters_data if
-                            char.get("nickname")}
-
-        def resolve_term(term):
-            term = term.strip()
-            if term.startswith("a:"):
-                return ("team_a", nickname_to_name.get(term[2:].lower(), term[2:]))
-            elif term.startswith("d:"):
-                return ("team_b", nickname_to_name.get(term[2:].lower(), term[2:]))
-            elif term.startswith("n:"):
-                return ("notes", term[2:])
+        found_ids = match_store.in_store_order(self.find_query_ids(groups))
+        corrections = "，".join(f"“{term}”按 {name}" for term, name in self.search_corrections.items())
+        if not found_ids:
+            message = f"没有找到匹配 '{search_query}' 的战绩记录。"
+            suggestions = list(dict.fromkeys(name for term in self.unresolved_terms
+                                             for name, _ in character_registry.match_names(term, 3, 0.15)))
+            if suggestions:
+                message += f"\n可能要找的角色：{'、'.join(suggestions[:5])}"
+            self.search_status_label.setText(message)
+            if live:
+                self.display_matches([])
             else:
-                return ("any", nickname_to_name.get(term.lower(), term))
-
-        def match_condition(team, value, match):
-            value = value.lower()
-            team_a = [m.lower() for m in match.get("team_a", [])]
-            team_b = [m.lower() for m in match.get("team_b", [])]
-            notes = match.get("notes", "").lower()
-            if team == "team_a":
-                return value in team_a
-            elif team == "team_b":
-                return value in team_b
-            elif team == "notes":
-                return value in notes
-            elif team == "any":
-                return value in team_a or value in team_b or value in notes
-            return False
-
-        terms = [t for t in search_query.split() if t]
-        for match in self.matches_data:
-            all_conditions_met = True
-            for term in terms:
-                team, value = resolve_term(term)
-                if not match_condition(team, value, match):
-                    all_conditions_met = False
-                    break
-            if all_conditions_met:
-                found_matches.append(match)
-
-        if not found_matches:
-            QMessageBox.information(self, "搜索结果", f"没有找到匹配 '{search_query}' 的战绩记录。")
+                QMessageBox.information(self, "搜索结果", message)
         else:
-            self.display_matches(found_matches)
+            self.search_status_label.setText(f"找到 {len(found_ids)} 条战绩" + (f"（{corrections}）" if corrections else ""))
+            self.display_matches(found_ids)
+
+    def resolve_search_term(self, kind, term):
+        # a:/d: 后面一定是角色，名称和昵称都对不上时按三元组模糊匹配；不带前缀的词只有在备注索引里
+        # 也找不到这段文字时才模糊匹配，以免把想搜的备注当成角色名
+        matches = character_registry.match_names(term, limit=1)
+        if matches and matches[0][1] < 1 and (match_store.ids_with_member(term)
+                                              or kind == "any" and match_store.notes_estimate(term)):
+            # 历史战绩里就有这个名字（已从角色表删除的角色），或备注里有这段文字：按原样搜索
+            matches = []
+        if not matches:
+            self.unresolved_terms.append(term)
+            return term
+        name = matches[0][0]
+        if matches[0][1] < 1:
+            self.search_corrections[term] = name
+        return name
+
+    def find_query_ids(self, groups):
+        # 各 AND 组分别求值（各自走缓存），再取并集
+        if len(groups) == 1:
+            return self.find_match_ids(groups[0])
+        return union_postings([self.find_match_ids(group) for group in groups])
+
+    def find_match_ids(self, group):
+        # 返回一个 AND 组按 id 升序的结果。命中缓存直接返回；新查询是在缓存中某个查询上追加条件时，
+        # 以那次的结果为候选，只执行新增的条件
+        versions = (match_store.version(), character_registry.version())
+        found_ids = self.search_cache.get(group, versions)
+        if found_ids is not None:
+            return found_ids
+        base_group, base_ids = self.search_cache.closest_subset(group, versions)
+        remaining = tuple(predicate for predicate in group if predicate not in base_group)
+        found_ids = MatchQueryPlan(match_store, remaining, base_ids).run()
+        self.search_cache.put(group, versions, found_ids)
+        return found_ids
+
+    def explain_search(self):
+        # 不查缓存重新执行一遍，列出每个 AND 组的执行步骤、预估与实际条数和耗时
+        search_query = self.search_input.text().strip().lower()
+        self.search_corrections = {}
+        self.unresolved_terms = []
+        groups = parse_match_query(search_query, self.resolve_search_term)
+        if not groups:
+            QMessageBox.information(self, "查询计划", "请输入搜索条件")
+            return
+        started = time.perf_counter()
+        plans = [MatchQueryPlan(match_store, group) for group in groups]
+        results = [plan.run() for plan in plans]
+        found_ids = union_postings(results) if len(results) > 1 else results[0]
+        elapsed = time.perf_counter() - started
+        lines = [f"第 {number} 组（AND）：{plan.explain()}" for number, plan in enumerate(plans, 1)]
+        if len(plans) > 1:
+            lines.append(f"各组取并集（OR）：{len(found_ids)} 条")
+        lines.append(f"共 {len(found_ids)} 条，总耗时 {elapsed * 1000:.2f} ms（含编译计划）")
+        footprint = match_store.notes_index.memory_footprint()
+        lines.append(f"备注索引：{footprint['grams']} 个 gram，{footprint['entries']} 条倒排，"
+                     f"约 {footprint['bytes'] // 1024} KB")
+        QMessageBox.information(self, "查询计划", "\n".join(lines))
 
     def search_by_drag(self):
 
@@ -1054,9 +4352,9 @@ class MatchViewer(QDialog):
                 return
             query_parts = []
             for char in team_a:
-                query_parts.append(f"a:{char}")
+                query_parts.append(f'a:"{char}"' if " " in char else f"a:{char}")
             for char in team_b:
-                query_parts.append(f"d:{char}")
+                query_parts.append(f'd:"{char}"' if " " in char else f"d:{char}")
             search_query = " ".join(query_parts)
             self.search_input.setText(search_query)
             self.search_matches()
@@ -1064,6 +4362,18 @@ class MatchViewer(QDialog):
             print(f"搜索错误: {e}")
             QMessageBox.critical(self, "错误", f"搜索失败: {e}")
 
+    def recommend_attacks(self):
+        defense = [label.character_name for label in self.team_b_search_labels if label.character_name]
+        if not defense:
+            QMessageBox.information(self, "提示", "请先拖放防守方角色")
+            return
+        recommendations = match_store.recommend_attacks(defense)
+        if not recommendations:
+            QMessageBox.information(self, "提示", "没有相似防守的历史战绩")
+            return
+        dialog = CounterPickDialog(defense, recommendations, self)
+        dialog.exec_()
+
     def clear_search_and_display_all(self):
         self.search_input.clear()
         self.display_matches()
@@ -1079,12 +4389,12 @@ class MatchViewer(QDialog):
             QMessageBox.critical(self, "错误", f"清除拖放失败: {e}")
 
     def delete_match(self):
-        selected_items = self.match_list_widget.selectedItems()
-        if not selected_items:
+        selected_rows = self.selected_match_rows()
+        if not selected_rows:
             QMessageBox.information(self, "提示", "请先选择至少一条战绩记录。")
             return
 
-        num_matches = len(selected_items)
+        num_matches = len(selected_rows)
         reply = QMessageBox.question(
             self, "确认删除",
             f"确定要删除 {num_matches} 条战绩记录吗？",
@@ -1093,21 +4403,11 @@ class MatchViewer(QDialog):
         if reply == QMessageBox.No:
             return
 
-        indices = []
-        for item in selected_items:
-            widget = self.match_list_widget.itemWidget(item)
-            if widget:
-                indices.append(widget.data_index)
-        indices.sort(reverse=True)
+        match_ids = [match_id for match_id, _ in selected_rows]
 
         try:
-            for index in indices:
-                if 0 <= index < len(self.matches_data):
-                    del self.matches_data[index]
-
-            with open(MATCH_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.matches_data, f, indent=2, ensure_ascii=False)
-
+            match_store.delete(match_ids)
+            self.matches_data = match_store.matches()
             self.display_matches()
 
             if self.parent():
@@ -1118,40 +4418,49 @@ class MatchViewer(QDialog):
             QMessageBox.critical(self, "错误", f"删除战绩失败: {e}")
 
     def export_matches(self):
-        selected_items = self.match_list_widget.selectedItems()
-        if not selected_items:
+        selected_rows = self.selected_match_rows()
+        if not selected_rows:
             QMessageBox.information(self, "提示", "请至少选择一条战绩进行导出。")
             return
 
-        selected_matches = [self.match_list_widget.itemWidget(item).match_data for item in selected_items]
-        file_path, _ = QFileDialog.getSaveFileName(self, "保存战绩文件", "", "JSON Files (*.json)")
+        selected_matches = [match for _, match in selected_rows]
+        file_path, _ = QFileDialog.getSaveFileName(self, "保存战绩文件", "",
+                                                   "JSON Files (*.json);;Match Archive (*.nka)")
         if not file_path:
             return
 
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(selected_matches, f, indent=2, ensure_ascii=False)
+            if file_path.endswith(".nka"):
+                write_match_archive(file_path, selected_matches)
+            else:
+                with open(file_path, "w", encoding="utf-8") as f:
+                    json.dump([dict(match) for match in selected_matches], f, indent=2, ensure_ascii=False)
             QMessageBox.information(self, "导出成功", f"成功导出 {len(selected_matches)} 条战绩到 {file_path}。")
         except Exception as e:
             QMessageBox.critical(self, "导出失败", f"导出战绩时发生错误: {e}")
 
     def import_matches(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "导入战绩文件", "", "JSON Files (*.json)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "导入战绩文件", "",
+                                                   "JSON Files (*.json);;Match Archive (*.nka)")
         if not file_path:
             return
 
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                import_data = json.load(f)
+            if file_path.endswith(".nka"):
+                with MatchArchiveReader(file_path) as reader:
+                    import_data = reader.records()
+            else:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    import_data = json.load(f)
         except Exception as e:
-            QMessageBox.critical(self, "导入失败", f"无法解析 JSON 文件: {e}")
+            QMessageBox.critical(self, "导入失败", f"无法解析战绩文件: {e}")
             return
 
         if not isinstance(import_data, list):
             QMessageBox.critical(self, "导入错误", "文件格式错误，必须是战绩列表。")
             return
 
-        all_chars = {char["name"] for char in self.characters_data}
+        all_chars = character_registry.names()
         valid_matches = []
         invalid_chars = set()
         for match in import_data:
@@ -1172,11 +4481,8 @@ class MatchViewer(QDialog):
             return
 
         try:
-            with open(MATCH_FILE, "r+", encoding="utf-8") as f:
-                self.matches_data.extend(valid_matches)
-                f.seek(0)
-                json.dump(self.matches_data, f, indent=2, ensure_ascii=False)
-                f.truncate()
+            match_store.extend(valid_matches)
+            self.matches_data = match_store.matches()
             self.display_matches()
             message = f"成功导入了 {len(valid_matches)} 条战绩记录。"
             if invalid_chars:
@@ -1188,22 +4494,299 @@ class MatchViewer(QDialog):
             QMessageBox.critical(self, "导入失败", f"保存战绩失败: {e}")
 
     def update_character_order(self):
-        new_order = []
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            name = item.data(Qt.UserRole)
-            for char in self.characters_data:
-                if char["name"] == name:
-                    new_order.append(char)
-                    break
-        self.characters_data = new_order
+        # 共享的角色列表模型已经移好，主窗口不用重新加载
+        character_registry.reorder(shared_roster_model().names())
+        self.characters_data = character_registry.characters()
+
+class TeamFinderDialog(QDialog):
+    # 配队搜索：约束输入 + 分片运行 TeamFinder（或多进程穷举），结果边搜边刷新；双击结果填入进攻方
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_widget = parent
+        self.finder = None
+        self.search_steps = None
+        self.job = None
+        self.job_timer = QTimer(self)
+        self.job_timer.setInterval(100)
+        self.job_timer.timeout.connect(self.poll_job)
+        self.shown_results = None
+        self.setWindowTitle("配队搜索")
+        self.resize(640, 520)
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        form_layout = QFormLayout()
+        self.required_input = DroppableLineEdit()
+        self.required_input.setPlaceholderText("拖入或输入角色名称/昵称，空格分隔")
+        form_layout.addRow("必选：", self.required_input)
+        self.excluded_input = DroppableLineEdit()
+        self.excluded_input.setPlaceholderText("拖入或输入角色名称/昵称，空格分隔")
+        form_layout.addRow("排除：", self.excluded_input)
+
+        type_layout = QHBoxLayout()
+        self.type_spins = {}
+        for char_type in CHARACTER_TYPES:
+            spin = QSpinBox()
+            spin.setRange(0, TEAM_SIZE)
+            type_layout.addWidget(QLabel(f"{char_type}至少"))
+            type_layout.addWidget(spin)
+            self.type_spins[char_type] = spin
+        type_layout.addStretch()
+        form_layout.addRow("类型：", type_layout)
+
+        rank_layout = QHBoxLayout()
+        self.rank_checks = {}
+        for rank in BURST_RANKS:
+            check = QCheckBox(rank)
+            rank_layout.addWidget(check)
+            self.rank_checks[rank] = check
+        rank_layout.addStretch()
+        form_layout.addRow("爆裂覆盖：", rank_layout)
+
+        self.top_k_spin = QSpinBox()
+        self.top_k_spin.setRange(1, 500)
+        self.top_k_spin.setValue(20)
+        form_layout.addRow("结果数：", self.top_k_spin)
+        self.defense_input = DroppableLineEdit()
+        self.defense_input.setPlaceholderText("可选，多核穷举时按对阵这套防守的历史胜率排序")
+        form_layout.addRow("对阵防守：", self.defense_input)
+        layout.addLayout(form_layout)
+
+        btn_layout = QHBoxLayout()
+        self.search_btn = QPushButton("搜索")
+        self.search_btn.setStyleSheet(BUTTON_STYLE["primary"])
+        self.search_btn.clicked.connect(self.start_search)
+        self.enumerate_btn = QPushButton("多核穷举")
+        self.enumerate_btn.setStyleSheet(BUTTON_STYLE["primary"])
+        self.enumerate_btn.clicked.connect(self.start_enumeration)
+        self.stop_btn = QPushButton("停止")
+        self.stop_btn.setStyleSheet(BUTTON_STYLE["secondary"])
+        self.stop_btn.clicked.connect(self.stop_search)
+        self.stop_btn.setEnabled(False)
+        btn_layout.addWidget(self.search_btn)
+        btn_layout.addWidget(self.enumerate_btn)
+        btn_layout.addWidget(self.stop_btn)
+        layout.addLayout(btn_layout)
+
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+        self.result_list = QListWidget()
+        self.result_list.itemDoubleClicked.connect(self.use_team)
+        layout.addWidget(self.result_list)
+        self.setLayout(layout)
+
+    def parse_names(self, line_edit):
+        return [character_registry.resolve_name(term) for term in line_edit.text().split()]
+
+    def constraints(self):
+        return {
+            "required": self.parse_names(self.required_input),
+            "excluded": self.parse_names(self.excluded_input),
+            "type_mins": {char_type: spin.value() for char_type, spin in self.type_spins.items()},
+            "ranks": [rank for rank, check in self.rank_checks.items() if check.isChecked()],
+            "top_k": self.top_k_spin.value(),
+        }
+
+    def set_running(self, running):
+        self.search_btn.setEnabled(not running)
+        self.enumerate_btn.setEnabled(not running)
+        self.stop_btn.setEnabled(running)
+
+    def start_search(self):
+        self.stop_search()
         try:
-            with open(CHAR_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.characters_data, f, indent=2, ensure_ascii=False)
-            if self.parent() and isinstance(self.parent(), CharacterManager):
-                self.parent().load_characters()
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"保存角色顺序失败: {e}")
+            self.finder = TeamFinder(rl_stats, character_registry, **self.constraints())
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
+        self.search_steps = self.finder.search()
+        self.shown_results = None
+        self.result_list.clear()
+        self.set_running(True)
+        QTimer.singleShot(0, self.step)
+
+    def start_enumeration(self):
+        self.stop_search()
+        try:
+            self.job = TeamEnumerationJob(rl_stats, character_registry,
+                                          defense=self.parse_names(self.defense_input), **self.constraints())
+            self.job.start()
+        except (ValueError, OSError) as e:
+            self.job = None
+            QMessageBox.warning(self, "警告", str(e))
+            return
+        self.finder = None
+        self.shown_results = None
+        self.result_list.clear()
+        self.set_running(True)
+        self.status_label.setText(f"多核穷举中，0/{self.job.total} 个任务")
+        self.job_timer.start()
+
+    def poll_job(self):
+        if self.job is None:
+            self.job_timer.stop()
+            return
+        finished = self.job.poll()
+        state = "已取消" if self.job.cancelled else ("已完成" if finished else "多核穷举中")
+        self.status_label.setText(f"{state}，{self.job.done}/{self.job.total} 个任务，"
+                                  f"已展开 {self.job.nodes} 个节点")
+        self.show_results([(tier, score, team) for tier, score, _, team in self.job.results()])
+        if finished:
+            self.job_timer.stop()
+            self.job = None
+            self.set_running(False)
+
+    def step(self):
+        if self.search_steps is None:
+            return
+        try:
+            next(self.search_steps)
+        except StopIteration:
+            self.search_steps = None
+        self.refresh_results()
+        if self.search_steps is not None:
+            QTimer.singleShot(0, self.step)
+        else:
+            self.set_running(False)
+
+    def stop_search(self):
+        if self.search_steps is not None:
+            self.search_steps.close()
+            self.search_steps = None
+            self.refresh_results()
+        if self.job is not None:
+            # 子进程在下一次检查取消标志时返回，poll_job 收尾并释放进程池
+            self.job.cancel()
+            return
+        self.set_running(False)
+
+    def refresh_results(self):
+        if self.finder is None:
+            return
+        results = self.finder.results()
+        state = "已完成" if self.finder.finished else ("搜索中" if self.search_steps is not None else "已停止")
+        self.status_label.setText(f"{state}，已展开 {self.finder.nodes} 个节点，找到 {len(results)} 支队伍")
+        self.show_results(results)
+
+    def show_results(self, results):
+        if results == self.shown_results:
+            return
+        self.shown_results = results
+        self.result_list.clear()
+        for tier, score, team in results:
+            item = QListWidgetItem(f"{RL_KEYS[tier]}: {score:.1f}    " + " / ".join(team))
+            item.setData(Qt.UserRole, list(team))
+            self.result_list.addItem(item)
+
+    def use_team(self, item):
+        if not hasattr(self.parent_widget, "team_a_labels"):
+            return
+        team = item.data(Qt.UserRole)
+        for label, name in zip(self.parent_widget.team_a_labels, team):
+            label.set_character(name)
+        self.parent_widget.update_team_stats()
+
+    def closeEvent(self, event):
+        self.stop_search()
+        self.close_job()
+        super().closeEvent(event)
+
+    def reject(self):
+        self.stop_search()
+        self.close_job()
+        super().reject()
+
+    def close_job(self):
+        if self.job is not None:
+            self.job_timer.stop()
+            self.job.close()
+            self.job = None
+
+class StatisticsDialog(QDialog):
+    # 战绩统计面板：直接读取物化的统计，不遍历战绩
+    MATRIX_SIZE = 30
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("战绩统计")
+        self.resize(1000, 700)
+        self.statistics = match_store.match_statistics()
+        layout = QVBoxLayout()
+        tabs = QTabWidget()
+        tabs.addTab(self.build_character_table(), "角色胜率")
+        tabs.addTab(self.build_matchup_table(), "对位矩阵")
+        layout.addWidget(tabs)
+        btn_layout = QHBoxLayout()
+        cache_stats = portrait_cache.stats()
+        btn_layout.addWidget(QLabel(
+            f"头像缓存：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次"
+            f"（命中率 {cache_stats['hit_rate']:.1%}），{cache_stats['entries']} 项 / "
+            f"{cache_stats['bytes'] // 1024} KB，淘汰 {cache_stats['evictions']} 次"))
+        btn_layout.addStretch()
+        verify_btn = QPushButton("重建校验")
+        verify_btn.setStyleSheet(BUTTON_STYLE["secondary"])
+        verify_btn.clicked.connect(self.verify)
+        btn_layout.addWidget(verify_btn)
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+
+    @staticmethod
+    def number_item(value):
+        item = QTableWidgetItem()
+        item.setData(Qt.DisplayRole, value)
+        return item
+
+    def build_character_table(self):
+        attack = self.statistics.attack
+        defense = self.statistics.defense
+        names = sorted(set(attack) | set(defense),
+                       key=lambda name: -(attack.get(name, [0, 0])[1] + defense.get(name, [0, 0])[1]))
+        table = QTableWidget(len(names), 5)
+        table.setHorizontalHeaderLabels(["角色", "进攻场次", "进攻胜率(%)", "防守场次", "防守胜率(%)"])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, name in enumerate(names):
+            table.setItem(row, 0, QTableWidgetItem(name))
+            for column, (wins, attempts) in ((1, attack.get(name, [0, 0])), (3, defense.get(name, [0, 0]))):
+                table.setItem(row, column, self.number_item(attempts))
+                table.setItem(row, column + 1, self.number_item(round(wins / attempts * 100, 1) if attempts else 0.0))
+        table.setSortingEnabled(True)
+        return table
+
+    def build_matchup_table(self):
+        # 只列出场次最多的若干进攻/防守角色；格子为进攻方胜率，颜色从红（0%）到绿（100%）
+        attack = self.statistics.attack
+        defense = self.statistics.defense
+        matchups = self.statistics.matchups
+        attackers = sorted(attack, key=lambda name: -attack[name][1])[:self.MATRIX_SIZE]
+        defenders = sorted(defense, key=lambda name: -defense[name][1])[:self.MATRIX_SIZE]
+        table = QTableWidget(len(attackers), len(defenders))
+        table.setVerticalHeaderLabels(attackers)
+        table.setHorizontalHeaderLabels(defenders)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, attacker in enumerate(attackers):
+            row_counts = matchups.get(attacker, {})
+            for column, defender in enumerate(defenders):
+                counts = row_counts.get(defender)
+                if not counts:
+                    continue
+                wins, attempts = counts
+                rate = wins / attempts
+                item = QTableWidgetItem(f"{rate:.0%} ({attempts})")
+                item.setBackground(QColor(int(255 * (1 - rate)), int(200 * rate), 80, 90))
+                item.setToolTip(f"{attacker} 进攻对 {defender} 防守: {wins}/{attempts}")
+                table.setItem(row, column, item)
+        table.resizeColumnsToContents()
+        return table
+
+    def verify(self):
+        mismatches = match_store.verify_statistics()
+        if not any(mismatches.values()):
+            QMessageBox.information(self, "成功", "统计与从头重建的结果一致。")
+            return
+        details = "\n".join(f"{part}: {', '.join(names[:10])}" for part, names in mismatches.items() if names)
+        QMessageBox.warning(self, "警告", f"统计与重建结果不一致:\n{details}")
 
 class CharacterManager(QWidget):
     def __init__(self):
@@ -1212,7 +4795,10 @@ class CharacterManager(QWidget):
         self.characters_data = []
         self.init_ui()
         self.load_characters()
-        self.update_match()
+        self.start_match_loading()
+        self.thumbnail_warmup = ThumbnailWarmup(
+            [path for path in (get_character_image_path(char["name"]) for char in self.characters_data) if path],
+            prune=True)
         if getattr(sys, 'frozen', False):
             base_path = sys._MEIPASS
         else:
@@ -1280,6 +4866,12 @@ class CharacterManager(QWidget):
         self.view_matches_btn = QPushButton("查看战绩")
         self.view_matches_btn.setStyleSheet(BUTTON_STYLE["primary"])
         left_layout.addWidget(self.view_matches_btn)
+        self.team_finder_btn = QPushButton("配队搜索")
+        self.team_finder_btn.setStyleSheet(BUTTON_STYLE["secondary"])
+        left_layout.addWidget(self.team_finder_btn)
+        self.statistics_btn = QPushButton("战绩统计")
+        self.statistics_btn.setStyleSheet(BUTTON_STYLE["secondary"])
+        left_layout.addWidget(self.statistics_btn)
         left_panel.setLayout(left_layout)
 
         right_panel = QWidget()
@@ -1345,11 +4937,11 @@ class CharacterManager(QWidget):
 
         char_list_group = QGroupBox("角色列表")
         char_list_layout = QVBoxLayout()
-        self.list_widget = DraggableListWidget(parent=self)
+        self.list_widget = CharacterListView(parent=self)
         self.list_widget.setIconSize(QSize(60, 60))
         self.list_widget.setViewMode(QListView.IconMode)
-        self.list_widget.setResizeMode(QListWidget.Adjust)
-        self.list_widget.setSelectionMode(QListWidget.ExtendedSelection)
+        self.list_widget.setResizeMode(QListView.Adjust)
+        self.list_widget.setSelectionMode(QListView.ExtendedSelection)
         char_list_layout.addWidget(self.list_widget)
 
         char_btn_layout = QHBoxLayout()
@@ -1394,6 +4986,8 @@ class CharacterManager(QWidget):
         self.add_match_btn.clicked.connect(self.add_match)
         self.clear_match_input_btn.clicked.connect(self.clear_match_input)
         self.view_matches_btn.clicked.connect(self.show_match_viewer)
+        self.team_finder_btn.clicked.connect(self.show_team_finder)
+        self.statistics_btn.clicked.connect(self.show_statistics)
 
     def clear_character_input(self):
         self.name_input.clear()
@@ -1443,16 +5037,10 @@ class CharacterManager(QWidget):
         if not name:
             QMessageBox.warning(self, "提示", "请输入角色名称")
             return
-        try:
-            with open(CHAR_FILE, "r", encoding="utf-8") as f:
-                characters = json.load(f)
-            for char in characters:
-                if char["name"] == name:
-                    QMessageBox.warning(self, "重复", f"角色 [{name}] 已存在")
-                    return
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"读取角色数据失败: {e}")
+        if name in character_registry:
+            QMessageBox.warning(self, "重复", f"角色 [{name}] 已存在")
             return
+        characters = character_registry.characters()
         if not self.selected_img_path:
             QMessageBox.warning(self, "提示", "请选择角色图片")
             return
@@ -1462,6 +5050,7 @@ class CharacterManager(QWidget):
         try:
             with open(self.selected_img_path, "rb") as src, open(img_dest_path, "wb") as dst:
                 dst.write(src.read())
+            invalidate_portrait(img_dest_path)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存图片失败: {e}")
             return
@@ -1479,8 +5068,7 @@ class CharacterManager(QWidget):
         }
         characters.append(new_char)
         try:
-            with open(CHAR_FILE, "w", encoding="utf-8") as f:
-                json.dump(characters, f, indent=2, ensure_ascii=False)
+            character_registry.save(characters)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存角色数据失败: {e}")
             return
@@ -1489,53 +5077,7 @@ class CharacterManager(QWidget):
         QMessageBox.information(self, "成功", f"角色 [{name}] 添加成功")
 
     def filter_characters(self):
-        self.list_widget.clear()
-        selected_type = self.filter_type_combo.currentText()
-        selected_rank = self.filter_rank_combo.currentText()
-        is_filtered = (selected_type != "所有类型" or selected_rank != "所有爆裂")
-        icon_cache = {}
-        filtered_chars = []
-        for char in self.characters_data:
-            name = char["name"]
-            char_type = char.get("type", "")
-            char_rank = char.get("rank", "")
-            type_match = (selected_type == "所有类型" or char_type == selected_type)
-            rank_match = (selected_rank == "所有爆裂" or char_rank == selected_rank)
-            if type_match and rank_match:
-                filtered_chars.append(char)
-        for char in filtered_chars:
-            name = char["name"]
-            item = QListWidgetItem()
-            img_path = os.path.join(IMG_DIR, char["image"])
-            if img_path not in icon_cache:
-                if os.path.exists(img_path):
-                    icon_cache[img_path] = QIcon(img_path)
-                else:
-                    icon_cache[img_path] = QIcon()
-            item.setIcon(icon_cache[img_path])
-            item.setData(Qt.UserRole, name)
-            font_metrics = self.list_widget.fontMetrics()
-            elided_name = font_metrics.elidedText(name, Qt.ElideRight, 60)
-            item.setText(elided_name)
-            tooltip_text = (
-                f"<p style='font-family: Arial; font-size: 12px;'>"
-                f"<table>"
-                f"<tr><td style='width: 80px;'>名称:</td><td>{char.get('name', '')}</td></tr>"
-                f"<tr><td style='width: 80px;'>昵称:</td><td>{char.get('nickname', '') or 'none'}</td></tr>"
-                f"<tr><td style='width: 80px;'>类型:</td><td>{char.get('type', '') or '未设置'}</td></tr>"
-                f"<tr><td style='width: 80px;'>等级:</td><td>{char.get('rank', '') or '未设置'}</td></tr>"
-                f"<tr><td style='width: 80px;'>2RL:</td><td>{char.get('2RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>2.5RL:</td><td>{char.get('2.5RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>3RL:</td><td>{char.get('3RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>3.5RL:</td><td>{char.get('3.5RL', 0):.1f}</td></tr>"
-                f"<tr><td style='width: 80px;'>4RL:</td><td>{char.get('4RL', 0):.1f}</td></tr>"
-                f"</table>"
-                f"</p>"
-            )
-            item.setToolTip(tooltip_text)
-            item.setTextAlignment(Qt.AlignHCenter)
-            item.setSizeHint(QSize(60, 80))
-            self.list_widget.addItem(item)
+        self.list_widget.set_filters(self.filter_type_combo.currentText(), self.filter_rank_combo.currentText())
 
     def select_all_chars(self):
         if self.list_widget.count() > 1000:
@@ -1546,26 +5088,19 @@ class CharacterManager(QWidget):
             )
             if reply == QMessageBox.No:
                 return
-        self.list_widget.blockSignals(True)
-        try:
-            for i in range(self.list_widget.count()):
-                item = self.list_widget.item(i)
-                if item is not None:
-                    item.setSelected(True)
-        finally:
-            self.list_widget.blockSignals(False)
+        self.list_widget.selectAll()
 
     def edit_character(self):
-        selected_items = self.list_widget.selectedItems()
-        if not selected_items:
+        selected_names = self.list_widget.selected_names()
+        if not selected_names:
             QMessageBox.information(self, "提示", "请先选择一个角色进行编辑")
             return
-        if len(selected_items) > 1:
+        if len(selected_names) > 1:
             QMessageBox.information(self, "提示", "一次只能编辑一个角色")
             return
 
-        char_name = selected_items[0].data(Qt.UserRole)
-        char_data = next((char for char in self.characters_data if char["name"] == char_name), None)
+        char_name = selected_names[0]
+        char_data = character_registry.get(char_name)
         if not char_data:
             QMessageBox.critical(self, "错误", "无法获取角色数据")
             return
@@ -1574,27 +5109,23 @@ class CharacterManager(QWidget):
         if dialog.exec_():
             updated_data = dialog.updated_data
             try:
-                with open(CHAR_FILE, "r+", encoding="utf-8") as f:
-                    characters = json.load(f)
-                    for i, char in enumerate(characters):
-                        if char["name"] == char_data["name"]:
-                            characters[i] = updated_data
-                            break
-                    f.seek(0)
-                    json.dump(characters, f, indent=2, ensure_ascii=False)
-                    f.truncate()
+                characters = character_registry.characters()
+                for i, char in enumerate(characters):
+                    if char["name"] == char_data["name"]:
+                        characters[i] = updated_data
+                        break
+                character_registry.save(characters)
                 self.load_characters()
                 QMessageBox.information(self, "成功", f"角色 [{updated_data['name']}] 已更新")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"更新角色失败: {e}")
 
     def delete_character(self):
-        selected_items = self.list_widget.selectedItems()
-        if not selected_items:
+        char_names = self.list_widget.selected_names()
+        if not char_names:
             QMessageBox.information(self, "提示", "请先选择至少一个角色")
             return
 
-        char_names = [item.data(Qt.UserRole) for item in selected_items]
         char_list = "\n".join([f"- {name}" for name in char_names])
 
         reply = QMessageBox.question(
@@ -1605,17 +5136,14 @@ class CharacterManager(QWidget):
 
         if reply == QMessageBox.Yes:
             try:
-                with open(CHAR_FILE, "r+", encoding="utf-8") as f:
-                    characters = json.load(f)
-                    remaining_chars = [c for c in characters if c["name"] not in char_names]
-                    f.seek(0)
-                    json.dump(remaining_chars, f, indent=2, ensure_ascii=False)
-                    f.truncate()
+                remaining_chars = [c for c in character_registry.characters() if c["name"] not in char_names]
+                character_registry.save(remaining_chars)
 
                 for name in char_names:
                     for fname in os.listdir(IMG_DIR):
                         if fname.startswith(name):
                             os.remove(os.path.join(IMG_DIR, fname))
+                            invalidate_portrait(os.path.join(IMG_DIR, fname))
 
                 self.load_characters()
                 QMessageBox.information(self, "成功", f"已删除 {len(char_names)} 个角色")
@@ -1623,12 +5151,11 @@ class CharacterManager(QWidget):
                 QMessageBox.critical(self, "错误", f"删除角色失败: {e}")
 
     def export_characters(self):
-        selected_items = self.list_widget.selectedItems()
-        if not selected_items:
+        selected_chars = self.list_widget.selected_names()
+        if not selected_chars:
             QMessageBox.information(self, "提示", "请先选择要导出的角色")
             return
 
-        selected_chars = [item.data(Qt.UserRole) for item in selected_items]
         export_data = [char for char in self.characters_data if char["name"] in selected_chars]
         file_path, _ = QFileDialog.getSaveFileName(self, "导出角色", "", "ZIP Files (*.zip)")
         if not file_path:
@@ -1707,7 +5234,7 @@ class CharacterManager(QWidget):
                 invalid_data = []
                 csv_dir = os.path.dirname(csv_path) if file_path.endswith('.csv') else temp_dir
 
-                existing_names = {char["name"] for char in self.characters_data}
+                existing_names = character_registry.names()
 
                 for row in reader:
                     name = row["名称"].strip()
@@ -1790,31 +5317,30 @@ class CharacterManager(QWidget):
                         error_msg += f"\n无效数据: {', '.join(invalid_data)}"
                     raise ValueError(error_msg)
 
-                with open(CHAR_FILE, "r+", encoding="utf-8") as f:
-                    characters = json.load(f)
-
-                    for overwrite_char in overwrite_chars:
-                        old_char = next((char for char in characters if char["name"] == overwrite_char["name"]), None)
-                        if old_char:
-                            characters.remove(old_char)
-                            if old_char["image"] != overwrite_char["image"]:
-                                old_img_path = os.path.join(IMG_DIR, old_char["image"])
-                                if os.path.exists(old_img_path):
-                                    os.remove(old_img_path)
-                            src_img_path = os.path.join(csv_dir, overwrite_char["image"])
-                            dest_img_path = os.path.join(IMG_DIR, overwrite_char["image"])
-                            shutil.copy2(src_img_path, dest_img_path)
-                        characters.append(overwrite_char)
-
-                    for new_char in import_data:
-                        src_img_path = os.path.join(csv_dir, new_char["image"])
-                        dest_img_path = os.path.join(IMG_DIR, new_char["image"])
+                characters = character_registry.characters()
+
+                for overwrite_char in overwrite_chars:
+                    old_char = next((char for char in characters if char["name"] == overwrite_char["name"]), None)
+                    if old_char:
+                        characters.remove(old_char)
+                        if old_char["image"] != overwrite_char["image"]:
+                            old_img_path = os.path.join(IMG_DIR, old_char["image"])
+                            invalidate_portrait(old_img_path)
+                            if os.path.exists(old_img_path):
+                                os.remove(old_img_path)
+                        src_img_path = os.path.join(csv_dir, overwrite_char["image"])
+                        dest_img_path = os.path.join(IMG_DIR, overwrite_char["image"])
                         shutil.copy2(src_img_path, dest_img_path)
-                        characters.append(new_char)
+                        invalidate_portrait(dest_img_path)
+                    characters.append(overwrite_char)
 
-                    f.seek(0)
-                    json.dump(characters, f, indent=2, ensure_ascii=False)
-                    f.truncate()
+                for new_char in import_data:
+                    src_img_path = os.path.join(csv_dir, new_char["image"])
+                    dest_img_path = os.path.join(IMG_DIR, new_char["image"])
+                    shutil.copy2(src_img_path, dest_img_path)
+                    invalidate_portrait(dest_img_path)
+                    characters.append(new_char)
+                character_registry.save(characters)
 
                 self.load_characters()
                 message = f"成功导入 {len(import_data)} 个新角色，覆盖 {len(overwrite_chars)} 个角色。"
@@ -1833,11 +5359,7 @@ class CharacterManager(QWidget):
                 shutil.rmtree(temp_dir, ignore_errors=True)
 
     def load_characters(self):
-        try:
-            with open(CHAR_FILE, "r", encoding="utf-8") as f:
-                self.characters_data = json.load(f)
-        except json.JSONDecodeError:
-            self.characters_data = []
+        self.characters_data = character_registry.characters()
         self.filter_characters()
 
     def add_match(self):
@@ -1850,10 +5372,9 @@ class CharacterManager(QWidget):
             QMessageBox.critical(self, "提示", "请至少选择一个角色")
             return
 
-        all_chars = {char["name"] for char in self.characters_data}
         missing_chars = []
         for char in team_a + team_b:
-            if char and char not in all_chars:
+            if char and char not in character_registry:
                 missing_chars.append(char)
 
         if missing_chars:
@@ -1868,12 +5389,7 @@ class CharacterManager(QWidget):
         }
 
         try:
-            with open(MATCH_FILE, "r+", encoding="utf-8") as f:
-                matches = json.load(f)
-                matches.append(match_record)
-                f.seek(0)
-                json.dump(matches, f, indent=4, ensure_ascii=False)
-                f.truncate()
+            match_store.add(match_record)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存战绩失败: {e}")
             return
@@ -1892,91 +5408,92 @@ class CharacterManager(QWidget):
         viewer = MatchViewer(self)
         viewer.exec_()
 
+    def show_team_finder(self):
+        dialog = TeamFinderDialog(self)
+        dialog.exec_()
+
+    def show_statistics(self):
+        dialog = StatisticsDialog(self)
+        dialog.exec_()
+
     def update_character_order(self):
-        new_order = []
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            name = item.data(Qt.UserRole)
-            for char in self.characters_data:
-                if char["name"] == name:
-                    new_order.append(char)
-                    break
-        self.characters_data = new_order
-        try:
-            with open(CHAR_FILE, "r+", encoding="utf-8") as f:
-                f.seek(0)
-                json.dump(self.characters_data, f, indent=2, ensure_ascii=False)
-                f.truncate()
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"保存角色顺序失败: {e}")
+        character_registry.reorder(shared_roster_model().names())
+        self.characters_data = character_registry.characters()
 
     def get_team(self, labels):
         return [label.character_name for label in labels if label.character_name]
 
     def update_team_stats(self):
-        def calculate_team_stats(labels):
-            stats = {"2RL": 0, "2.5RL": 0, "3RL": 0, "3.5RL": 0, "4RL": 0}
-            for label in labels:
-                if label.character_name:
-                    for char in self.characters_data:
-                        if char["name"] == label.character_name:
-                            for attr in stats:
-                                stats[attr] += float(char.get(attr, 0))
-            return stats
-
-        def format_stat(value, stat_name, is_first_highlight):
-            formatted_value = f"{value:.1f}"
-            if is_first_highlight:
-                return f"<span style='color: red; font-weight: bold;'>{stat_name}: {formatted_value}</span>"
-            return f"{stat_name}: {formatted_value}"
-
-        team_a_stats = calculate_team_stats(self.team_a_labels)
-        team_b_stats = calculate_team_stats(self.team_b_labels)
-
-        first_a_highlight = None
-        for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]:
-            if team_a_stats[attr] >= 100:
-                first_a_highlight = attr
-                break
-
-        first_b_highlight = None
-        for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]:
-            if team_b_stats[attr] >= 100:
-                first_b_highlight = attr
-                break
-
-        team_a_text = "进攻方: " + " | ".join(
-            format_stat(team_a_stats[attr], attr, attr == first_a_highlight)
-            for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]
-        )
-
-        team_b_text = "防守方: " + " | ".join(
-            format_stat(team_b_stats[attr], attr, attr == first_b_highlight)
-            for attr in ["2RL", "2.5RL", "3RL", "3.5RL", "4RL"]
-        )
+        self.team_a_stats.setText(format_team_stats("进攻方", self.get_team(self.team_a_labels)))
+        self.team_b_stats.setText(format_team_stats("防守方", self.get_team(self.team_b_labels)))
+
+    def start_match_loading(self):
+        # 战绩在后台线程加载，启动时不阻塞界面；加载完再填最近战绩预览
+        self.match_load_job = match_store.load_in_background()
+        if self.match_load_job is None:
+            self.update_match()
+            return
+        self.match_load_job.attach()
+        self.match_load_timer = QTimer(self)
+        self.match_load_timer.timeout.connect(self.poll_match_loading)
+        self.match_load_timer.start(50)
 
-        self.team_a_stats.setText(team_a_text)
-        self.team_b_stats.setText(team_b_text)
+    def poll_match_loading(self):
+        if not match_store.poll_loading():
+            return
+        self.match_load_timer.stop()
+        self.match_load_job.detach()
+        self.match_load_job = None
+        self.update_match()
 
     def update_match(self):
         try:
-            with open(MATCH_FILE, "r", encoding="utf-8") as f:
-                matches = json.load(f)
-            self.latest_match_preview.update_preview(matches)
-        except json.JSONDecodeError as e:
-            print(f"JSON解码错误，文件：{MATCH_FILE}: {e}")
-            self.latest_match_preview.update_preview([])
-        except FileNotFoundError:
-            print(f"文件未找到：{MATCH_FILE}")
-            self.latest_match_preview.update_preview([])
+            self.latest_match_preview.update_preview(match_store.latest(3))
         except Exception as e:
             print(f"加载比赛时发生错误: {e}")
             self.latest_match_preview.update_preview([])
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--storage", choices=STORAGE_MODES, help="覆盖 settings.json 中的 match_storage")
+    parser.add_argument("--enumerate", action="store_true", help="不启动界面，多进程穷举配队并输出前 k 名")
+    parser.add_argument("--require", action="append", metavar="NAME", help="必选角色，可重复")
+    parser.add_argument("--exclude", action="append", metavar="NAME", help="排除角色，可重复")
+    parser.add_argument("--min-type", action="append", metavar="TYPE=N", help="某类型至少 N 人，如 火力型=2")
+    parser.add_argument("--ranks", nargs="+", choices=BURST_RANKS, help="需要覆盖的爆裂档位")
+    parser.add_argument("--defense", nargs="+", metavar="NAME", help="按对阵这套防守的历史胜率排序")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--convert", nargs=2, metavar=("SRC", "DST"), help="战绩 .json 与 .nka 归档互转")
+    parser.add_argument("--memory-benchmark", type=int, metavar="N", help="比较 N 条模拟战绩在字典列表与紧凑表下的内存")
+    args, qt_args = parser.parse_known_args()
+    if args.storage:
+        configure_storage(args.storage)
+    if args.enumerate:
+        sys.exit(run_enumeration(args))
+    if args.convert:
+        try:
+            count = convert_match_archive(*args.convert)
+        except (OSError, ValueError) as e:
+            print(f"转换失败: {e}")
+            sys.exit(1)
+        print(f"已转换 {count} 条战绩")
+        sys.exit(0)
+    if args.memory_benchmark:
+        result = match_memory_benchmark(args.memory_benchmark)
+        print(f"{result['matches']} 条战绩: 字典列表 {result['dict_bytes'] / 1048576:.1f} MB "
+              f"({result['dict_per_match']:.0f} B/条), 紧凑表 {result['compact_bytes'] / 1048576:.1f} MB "
+              f"({result['compact_per_match']:.0f} B/条)")
+        sys.exit(0)
+    app = QApplication(sys.argv[:1] + qt_args)
     QToolTip.setFont(QFont("Arial", 14))
     app.setStyleSheet("QToolTip { font-family: 'Arial'; font-size: 14px; }")
+    app.aboutToQuit.connect(thumbnail_store.flush)
+    app.aboutToQuit.connect(character_registry.flush_order)
+    app.aboutToQuit.connect(match_store.cancel_loading)
+    app.aboutToQuit.connect(match_store.compact)
+    app.aboutToQuit.connect(match_store.flush_indexes)
     window = CharacterManager()
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file